@@ -0,0 +1,183 @@
+import argparse
+import http.server
+import json
+import os
+import signal
+import socketserver
+import sys
+import time
+import urllib.request
+
+import text_prepare as tp
+from lazy import load
+from text_prepare_sentences import iter_sentences
+from wikt_dump import MultistreamDump
+
+# POST /accent {"texts": [...], "carry": false}
+#   -> {"results": [{"text": ..., "unresolved": [{"word", "start", "end", "candidates"}]}], "ms": ...}
+# offsets are in the returned text, sentences are separated by '\n' as in the files text_prepare.py writes
+
+
+def leave_unresolved(word, sentence):
+    return -1
+
+
+def accent_text(text, carry=False):
+    sentences = iter_sentences(text.splitlines(True), carry=carry)
+
+    parts = []
+    unresolved = []
+    offset = 0
+    for i, (s, spans) in enumerate(tp.accent_sentences(sentences, leave_unresolved)):
+        if i > 0:
+            offset += 1
+        parts.append(s)
+        for word, start, end in spans:
+            unresolved.append({'word': word, 'start': offset + start, 'end': offset + end,
+                               'candidates': tp.homograph_candidates(word)})
+        offset += len(s)
+
+    return {'text': '\n'.join(parts), 'unresolved': unresolved}
+
+
+class AccentHandler(http.server.BaseHTTPRequestHandler):
+    # keep-alive, a client sending many small texts does not reconnect for each
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out as separate writes, with Nagle every reply would wait for a delayed ack
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self.reply(404, {'error': 'not found'})
+        self.reply(200, {'ok': True, 'pid': os.getpid()})
+
+    def do_POST(self):
+        if self.path != '/accent':
+            return self.reply(404, {'error': 'not found'})
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            texts = request['texts']
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError('texts must be a list of strings')
+        except (ValueError, KeyError, TypeError) as e:
+            return self.reply(400, {'error': str(e)})
+
+        start = time.perf_counter()
+        results = [accent_text(t, bool(request.get('carry', False))) for t in texts]
+        self.reply(200, {'results': results, 'ms': round((time.perf_counter() - start) * 1000, 3)})
+
+    def reply(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixAccentHandler(AccentHandler):
+    # TCP_NODELAY does not exist for Unix sockets
+    disable_nagle_algorithm = False
+
+
+class HTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # bursts of clients connecting at once are queued instead of retrying after a second
+    request_queue_size = 128
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects a (host, port) pair
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def warm_up(models=True):
+    t = time.perf_counter()
+    load(tp.acc_dict)
+    if models:
+        load(tp.predictor)
+        load(tp.your_accentor)
+        load(tp.wiktparser)
+    print('warm in', round(time.perf_counter() - t, 1), 's')
+
+
+def serve(host='127.0.0.1', port=8765, unix=None, models=True):
+    warm_up(models)
+
+    if unix is not None:
+        if os.path.exists(unix):
+            os.remove(unix)
+        server = UnixHTTPServer(unix, UnixAccentHandler)
+        print('listening on', unix)
+    else:
+        server = HTTPServer((host, port), AccentHandler)
+        print('listening on http://{}:{}'.format(host, port))
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix is not None and os.path.exists(unix):
+            os.remove(unix)
+        # words learned from Wiktionary while serving
+        with tp.dict_lock:
+            tp.acc_dict.save_if_changed()
+
+
+def request(texts, url='http://127.0.0.1:8765', carry=False):
+    data = json.dumps({'texts': texts, 'carry': carry}, ensure_ascii=False).encode('utf-8')
+    req = urllib.request.Request(url + '/accent', data=data, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description='Keep the dictionary and the models loaded and accent texts on request.')
+    subparsers = args_parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('serve', help='run the server')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead, e.g. curl --unix-socket PATH')
+    p.add_argument('--no-models', action='store_true', help='load the models on first use instead of at start')
+    p.add_argument('--dump', help='read Wiktionary pages from an indexed multistream dump (see wikt_dump.py)')
+    p.add_argument('--offline', action='store_true', help='use only Wiktionary pages that are already cached')
+
+    p = subparsers.add_parser('request', help='accent stdin through a running server over HTTP')
+    p.add_argument('--url', default='http://127.0.0.1:8765')
+    p.add_argument('--carry', action='store_true')
+
+    args = args_parser.parse_args()
+
+    if args.command == 'serve':
+        if args.offline:
+            tp.wiktparser.wiki_cache.offline = True
+        if args.dump:
+            tp.wiktparser.wiki_dump = MultistreamDump(args.dump)
+        serve(args.host, args.port, args.unix, not args.no_models)
+
+    if args.command == 'request':
+        sys.stdin.reconfigure(encoding='utf-8')
+        sys.stdout.reconfigure(encoding='utf-8')
+        t = time.perf_counter()
+        response = request([sys.stdin.read()], args.url, args.carry)
+        print(response['results'][0]['text'])
+        for u in response['results'][0]['unresolved']:
+            print('unresolved', u['word'], u['start'], u['candidates'], file=sys.stderr)
+        print(round(response['ms'], 1), 'ms on the server,', round((time.perf_counter() - t) * 1000, 1), 'ms total',
+              file=sys.stderr)
@@ -0,0 +1,184 @@
+import argparse
+import bisect
+import mmap
+import os
+import pickle
+import struct
+from collections.abc import MutableMapping
+
+# layout: header | offsets[count + 1] (uint32) | positions[count] (uint8) | keys (utf-8, sorted by bytes)
+magic = b'ACC1'
+header = struct.Struct('<4sI')
+# every n-th key is kept in memory to narrow the search before touching the mapping
+sparse_step = 64
+
+
+def compile_accents(items, path):
+    items = sorted((k.encode('utf-8'), v) for k, v in items)
+
+    offsets = [0]
+    for k, v in items:
+        if not 0 <= v < 256:
+            raise ValueError('accent position out of range', k.decode('utf-8'), v)
+        offsets.append(offsets[-1] + len(k))
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header.pack(magic, len(items)))
+        f.write(struct.pack('<%dI' % len(offsets), *offsets))
+        f.write(bytes(v for k, v in items))
+        for k, v in items:
+            f.write(k)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+    return len(items)
+
+
+def convert_pickle(src=r'accents.pickle', dst=r'accents.bin'):
+    with open(src, 'rb') as f:
+        accents = pickle.load(f)
+    return compile_accents(accents.items(), dst)
+
+
+_missing = object()
+
+
+# compiled accents are queried in place, changes are kept in an overlay until save()
+class AccentStore(MutableMapping):
+
+    def __init__(self, path):
+        self.path = path
+        self._added = {}
+        self._removed = set()
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        m, self._count = header.unpack_from(self._mm, 0)
+        if m != magic:
+            raise ValueError('not a compiled accents file', self.path)
+
+        start = header.size
+        self._offsets = memoryview(self._mm)[start:start + 4 * (self._count + 1)].cast('I')
+        self._positions_start = start + 4 * (self._count + 1)
+        self._keys_start = self._positions_start + self._count
+        self._size = self._count
+        self._sparse = [self._key(i) for i in range(0, self._count, sparse_step)]
+
+    def close(self):
+        self._offsets.release()
+        self._mm.close()
+        self._file.close()
+
+    def _key(self, i):
+        return self._mm[self._keys_start + self._offsets[i]:self._keys_start + self._offsets[i + 1]]
+
+    def _find(self, word):
+        key = word.encode('utf-8')
+        block = bisect.bisect_right(self._sparse, key) - 1
+        if block < 0:
+            return -1
+        lo = block * sparse_step
+        hi = min(lo + sparse_step, self._count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._key(lo) == key:
+            return lo
+        return -1
+
+    def _base_get(self, word, default=None):
+        if word in self._removed:
+            return default
+        i = self._find(word)
+        if i == -1:
+            return default
+        return self._mm[self._positions_start + i]
+
+    def __getitem__(self, word):
+        v = self._added.get(word, _missing)
+        if v is _missing:
+            v = self._base_get(word, _missing)
+            if v is _missing:
+                raise KeyError(word)
+        return v
+
+    def get(self, word, default=None):
+        v = self._added.get(word, _missing)
+        if v is _missing:
+            return self._base_get(word, default)
+        return v
+
+    def __contains__(self, word):
+        return word in self._added or self._base_get(word) is not None
+
+    def __setitem__(self, word, pos):
+        if word not in self:
+            self._size += 1
+        self._added[word] = pos
+
+    def __delitem__(self, word):
+        found = self._added.pop(word, _missing) is not _missing
+        if word not in self._removed and self._find(word) != -1:
+            self._removed.add(word)
+            found = True
+        if not found:
+            raise KeyError(word)
+        self._size -= 1
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for i in range(self._count):
+            word = self._key(i).decode('utf-8')
+            if word not in self._removed and word not in self._added:
+                yield word
+        yield from list(self._added)
+
+    def _items(self):
+        for i in range(self._count):
+            word = self._key(i).decode('utf-8')
+            if word not in self._removed and word not in self._added:
+                yield word, self._mm[self._positions_start + i]
+        yield from self._added.items()
+
+    def merge(self, changes):
+        # bulk changes skip the membership checks of __setitem__, None removes a word
+        for word, pos in changes.items():
+            if pos is None:
+                self._added.pop(word, None)
+                self._removed.add(word)
+            else:
+                self._added[word] = pos
+        self.save()
+
+    def save(self, path=None):
+        path = path or self.path
+        if path == self.path and len(self._added) == 0 and len(self._removed) == 0: return
+        tmp = path + '.new'
+        compile_accents(self._items(), tmp)
+
+        # the mapping has to be closed before replacing the file on Windows
+        self.close()
+        os.replace(tmp, path)
+        self.path = path
+        self._added = {}
+        self._removed = set()
+        self._open()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compile accents.pickle into a memory-mapped accents store.')
+    parser.add_argument('src', nargs='?', default=r'accents.pickle')
+    parser.add_argument('dst', nargs='?', default=r'accents.bin')
+    args = parser.parse_args()
+
+    print(convert_pickle(args.src, args.dst), 'words written to', args.dst)
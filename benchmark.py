@@ -0,0 +1,1089 @@
+import argparse
+import contextlib
+import copy
+import http.client
+import http.server
+import io
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+load_script = '''
+import json, os, pickle, random, sys, time
+
+def rss():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+mode, path = sys.argv[1], sys.argv[2]
+words = json.load(sys.stdin)
+rss_before = rss()
+t = time.perf_counter()
+if mode == 'pickle':
+    with open(path, 'rb') as f:
+        accents = pickle.load(f)
+else:
+    from accent_store import AccentStore
+    accents = AccentStore(path)
+load_time = time.perf_counter() - t
+
+t = time.perf_counter()
+for w in words:
+    accents.get(w)
+lookup_time = time.perf_counter() - t
+
+print(json.dumps({'load_s': load_time, 'rss_mb': (rss() - rss_before) / 2 ** 20,
+                  'lookup_us': lookup_time / max(len(words), 1) * 1e6}))
+'''
+
+
+def run_load(mode, path, words):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, '-c', load_script, mode, path], input=json.dumps(words),
+                         capture_output=True, text=True, check=True, env=env).stdout
+    return json.loads(out)
+
+
+def bench_load(pickle_path=r'accents.pickle', store_path=r'accents.bin', lookups=10000):
+    from accent_store import AccentStore
+
+    store = AccentStore(store_path)
+    words = random.Random(0).sample(list(store), min(lookups, len(store)))
+    store.close()
+
+    results = {'pickle': run_load('pickle', pickle_path, words),
+               'mmap': run_load('mmap', store_path, words)}
+
+    for mode, r in results.items():
+        print('{:8} load {:8.3f} s   rss {:8.1f} MB   lookup {:6.2f} us'.format(mode, r['load_s'], r['rss_mb'], r['lookup_us']))
+
+    return results
+
+
+def bench_disambiguation(fname, limit=None):
+    import text_prepare as tp
+    from text_prepare_sentences import prepare_sentences
+
+    with open(fname, encoding='utf-8') as f:
+        sentences = prepare_sentences(f.readlines())[:limit]
+    sentences_words = [tp.p.findall(s) for s in sentences]
+
+    # one predict() per homograph occurrence, the way get_accent used to call the model
+    t = time.perf_counter()
+    for words in sentences_words:
+        for w in words:
+            if w in tp.acc_dict.homographs or w.lower() in tp.acc_dict.homographs:
+                tp.predictor.predict(words)
+    before = time.perf_counter() - t
+
+    t = time.perf_counter()
+    tp.predict_sentences(sentences_words)
+    after = time.perf_counter() - t
+
+    results = {'sentences': len(sentences),
+               'before_sent_per_s': len(sentences) / before,
+               'after_sent_per_s': len(sentences) / after}
+    print('{} sentences: {:.1f} -> {:.1f} sentences/s'.format(
+        len(sentences), results['before_sent_per_s'], results['after_sent_per_s']))
+
+    return results
+
+
+def soup_table_to_2d(table_tag):
+    # the BeautifulSoup two-pass version table_to_2d replaced, kept as the reference
+    from itertools import product
+
+    rowspans = []
+    rows = table_tag.find_all('tr')
+    colcount = 0
+    for r, row in enumerate(rows):
+        cells = row.find_all(['td', 'th'], recursive=False)
+        colcount = max(
+            colcount,
+            sum(int(c.get('colspan', 1)) or 1 for c in cells[:-1]) + len(cells[-1:]) + len(rowspans))
+        rowspans += [int(c.get('rowspan', 1)) or len(rows) - r for c in cells]
+        rowspans = [s - 1 for s in rowspans if s > 1]
+
+    table = [[None] * colcount for row in rows]
+    rowspans = {}
+    for row, row_elem in enumerate(rows):
+        span_offset = 0
+        for col, cell in enumerate(row_elem.find_all(['td', 'th'], recursive=False)):
+            col += span_offset
+            while rowspans.get(col, 0):
+                span_offset += 1
+                col += 1
+            rowspan = rowspans[col] = int(cell.get('rowspan', 1)) or len(rows) - row
+            colspan = int(cell.get('colspan', 1)) or colcount - col
+            span_offset += colspan - 1
+            value = cell.get_text()
+            for drow, dcol in product(range(rowspan), range(colspan)):
+                try:
+                    table[row + drow][col + dcol] = value
+                    rowspans[col + dcol] = rowspan
+                except IndexError:
+                    pass
+        rowspans = {c: s - 1 for c, s in rowspans.items() if s > 1}
+
+    return table
+
+
+def verb_fixture(stem):
+    # shaped like the participle rows of a 'гл ru' expansion
+    rows = ['<tr><th rowspan="2">[[лицо]]</th><th colspan="2">[[настоящее время|Наст.]]</th><th rowspan="2">[[прошедшее время|Прош.]]</th></tr>',
+            '<tr><th>ед.</th><th>мн.</th></tr>']
+    for person, sg, pl in (('я', 'ю', 'ем'), ('ты', 'ешь', 'ете'), ('он', 'ет', 'ют')):
+        rows.append('<tr><th>[[{}]]</th><td>{}а́{}</td><td>{}а́{}</td><td rowspan="3">{}а́л<br>{}а́ла</td></tr>'.format(
+            person, stem, sg, stem, pl, stem, stem))
+    for name, ending in (('[[причастие|Пр. действ. наст.]]', 'ющий'), ('[[причастие|Пр. действ. прош.]]', 'вший'),
+                         ('[[деепричастие|Деепр. наст.]]', 'я'), ('[[деепричастие|Деепр. прош.]]', 'в, вши')):
+        rows.append('<tr><th>{}</th><td colspan="3">[[{}а{}|{}а́{}]]</td></tr>'.format(name, stem, ending, stem, ending))
+    rows.append('<tr><th>[[будущее время|Будущее]]</th><td colspan="0">буду/будешь… {}а́ть</td></tr>'.format(stem))
+    return '<table>' + '\n'.join(rows) + '</table>'
+
+
+def template_fixture(template, word):
+    # what the API would return for the regular paradigms: nouns from the local engine, adjectives from its
+    # full-form tables, which expand leaves to the API
+    import wikt_inflection
+
+    if template.startswith('прил ru '):
+        return wikt_inflection.adjective_table(wikt_inflection.adjective_paradigm(word, template.split()[2]))
+    return wikt_inflection.expand(template, word, {})
+
+
+def bench_tables(recorded=None, repeat=200):
+    from bs4 import BeautifulSoup
+    from wikt_template_parser import html_table, table_to_2d
+
+    if recorded is not None:
+        with open(recorded, encoding='utf-8') as f:
+            fixtures = [(r['template'], r['expansion']) for r in json.load(f)
+                        if 'прил ru' in r['template'] or 'гл ru' in r['template']]
+    else:
+        fixtures = [('прил ru', template_fixture('прил ru 1a', w)) for w in ('но́вый', 'краси́вый', 'до́брый')]
+        fixtures += [('гл ru', verb_fixture(s)) for s in ('дел', 'чит', 'игр')]
+
+    def wrap(template, text):
+        # 'гл ru' tables are read as extra rows of the whole expansion
+        return '<table>' + text + '</table>' if 'гл ru' in template else text
+
+    for template, text in fixtures:
+        expected = soup_table_to_2d(BeautifulSoup(wrap(template, text).replace('<br>', '\n'), 'lxml').table)
+        if table_to_2d(html_table(wrap(template, text))) != expected:
+            raise Exception('different cell matrix', template)
+
+    t = time.perf_counter()
+    for _ in range(repeat):
+        for template, text in fixtures:
+            soup_table_to_2d(BeautifulSoup(wrap(template, text).replace('<br>', '\n'), 'lxml').table)
+    before = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for _ in range(repeat):
+        for template, text in fixtures:
+            table_to_2d(html_table(wrap(template, text)))
+    after = time.perf_counter() - t
+
+    count = repeat * len(fixtures)
+    results = {'tables': len(fixtures), 'before_us': before / count * 1e6, 'after_us': after / count * 1e6}
+    print('{} tables, identical matrices: {:.1f} -> {:.1f} us per table'.format(
+        len(fixtures), results['before_us'], results['after_us']))
+
+    return results
+
+
+page_templates = [
+    ('сущ ru m ina 1c', 'сто́л'), ('сущ ru f ina 1a', 'ко́мната'), ('сущ ru n ina 1c', 'ме́сто'),
+    ('сущ ru m a 2b', 'ко́нь'), ('прил ru 1a', 'краси́вый'), ('прил ru 4a', 'горя́чий'),
+]
+
+
+def page_fixture(template, word):
+    return '= {{-ru-}} =\n\n=== Морфологические и синтаксические свойства ===\n\n{{' + template + \
+           '\n|слоги={{по-слогам|' + word + '}}\n}}\n'
+
+
+def reference_dict_to_tag_UD(data):
+    # the strings add_variants built from a UD dict before immutable tags, one per value of a list feature
+    for key, value in data['tag'].items():
+        if isinstance(value, list):
+            strings = []
+            for v in value:
+                td = copy.deepcopy(data)
+                td['tag'][key] = v
+                strings += reference_dict_to_tag_UD(td)
+            return strings
+
+    tag = data['base'] + ' ' + data['pos']
+    if len(data['tag']) > 0:
+        tag += ' '
+        for key in data['tag']:
+            tag += key + '=' + data['tag'][key] + '|'
+        tag = tag[:-1]
+    return [tag]
+
+
+def bench_pages(count=300):
+    # inflection pages expanded locally, down to the strings add_variants stores
+    import tracemalloc
+    import wikitextparser as wtp
+    import wiktparser
+
+    pages = [(word.replace('́', ''), page_fixture(template, word)) for template, word in page_templates]
+    pages = [pages[i % len(pages)] for i in range(count)]
+    parsed = [(word, wtp.parse(text)) for word, text in pages]
+
+    # both runs keep the variants of every page, the way a worker of ingest_pages holds them until it returns
+    def run():
+        kept = []
+        for word, page in parsed:
+            variants = wiktparser.parse_wikt_ru(word, page)
+            for words, tag in variants:
+                tag.ud_strings()
+            kept.append(variants)
+        return kept
+
+    def run_baseline():
+        # parse_template deep-copied the OpenCorpora and the UD dict for every cell and add_variants built
+        # the strings from the UD copy; the dicts are made up front, so only that per-cell work is added
+        kept = []
+        for (word, page), page_dicts in zip(parsed, dicts):
+            wiktparser.parse_wikt_ru(word, page)
+            variants = [[words, copy.deepcopy(oc), copy.deepcopy(ud)] for words, oc, ud in page_dicts]
+            for var in variants:
+                reference_dict_to_tag_UD(var[2])
+            kept.append(variants)
+        return kept
+
+    def measure(fn, repeat=5):
+        elapsed = float('inf')
+        for _ in range(repeat):
+            t = time.perf_counter()
+            fn()
+            elapsed = min(elapsed, time.perf_counter() - t)
+
+        tracemalloc.start()
+        kept = fn()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        return {'ms_per_page': elapsed / count * 1000, 'peak_kb': peak / 1024, 'kept_kb': current / 1024}
+
+    # expansions come from the fixtures, nothing goes to the API
+    expansions = {(template, word.replace('́', '')): template_fixture(template, word) for template, word in page_templates}
+    expand_template = wiktparser.expand_template
+    wiktparser.expand_template = lambda template, language='ru': \
+        expansions[template.name.strip(), wiktparser.template_headword(template).replace('́', '')]
+    try:
+        dicts = [[(words, tag.opencorpora(), tag.universal()) for words, tag in wiktparser.parse_wikt_ru(word, page)]
+                 for word, page in parsed]
+        for page_dicts, (word, page) in zip(dicts, parsed[:len(page_templates)]):
+            expected = [s for words, tag in wiktparser.parse_wikt_ru(word, page) for s in tag.ud_strings()]
+            if [s for words, oc, ud in page_dicts for s in reference_dict_to_tag_UD(ud)] != expected:
+                raise Exception('different UD strings', word)
+
+        # caches of the table parsing fill on the first pass, neither side should pay for them
+        run()
+        results = {'pages': count, 'baseline': measure(run_baseline), 'tags': measure(run)}
+    finally:
+        wiktparser.expand_template = expand_template
+
+    for name, label in (('baseline', 'deepcopy + dicts'), ('tags', 'immutable tags')):
+        r = results[name]
+        print('{:18} {} pages: {:.3f} ms per page, peak {:.1f} KB, variants {:.2f} KB per page'.format(
+            label, count, r['ms_per_page'], r['peak_kb'], r['kept_kb'] / count))
+    print('immutable tags: {:.2f}x faster, {:.2f}x less memory held by the variants'.format(
+        results['baseline']['ms_per_page'] / results['tags']['ms_per_page'],
+        results['baseline']['kept_kb'] / results['tags']['kept_kb']))
+
+    return results
+
+
+def reference_normalize(line, keep_dash=False):
+    # the per-key replace chain normalize_line replaced, kept as the reference
+    from text_prepare_sentences import replacements, transliteration
+
+    line = re.sub(' +', ' ', line)
+
+    for k in replacements:
+        line = line.replace(k, replacements[k])
+
+    if not keep_dash:
+        line = line.replace(' - ', ' ')
+        line = line.replace('- ', ' ')
+        line = line.replace(' -', ' ')
+
+    for key in transliteration:
+        line = line.replace(key, transliteration[key])
+    return line
+
+
+def fuzz_lines(count, seed=0):
+    from text_prepare_sentences import replacements, transliteration
+
+    rnd = random.Random(seed)
+    alphabet = list(replacements) + list(transliteration) + list('  --  абвгдеёжзийклмнопрстуфхцчшщъыьэюя.,!?\'\n') + ['́']
+    return [''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 40))) for _ in range(count)]
+
+
+def bench_normalize(fname=None, repeat=3):
+    from text_prepare_sentences import normalize_line
+
+    for keep_dash in (False, True):
+        for line in fuzz_lines(200000):
+            if normalize_line(line, keep_dash) != reference_normalize(line, keep_dash):
+                raise Exception('different normalization', repr(line), keep_dash)
+
+    if fname is not None:
+        with open(fname, encoding='utf-8') as f:
+            lines = f.readlines()
+    else:
+        lines = synthetic_text(20000)
+    if [normalize_line(line) for line in lines] != [reference_normalize(line) for line in lines]:
+        raise Exception('different normalization', fname)
+    size = sum(len(line.encode('utf-8')) for line in lines) / 2 ** 20
+
+    results = {'mb': size}
+    for name, normalize in (('before', reference_normalize), ('after', normalize_line)):
+        best = float('inf')
+        for _ in range(repeat):
+            t = time.perf_counter()
+            for line in lines:
+                normalize(line)
+            best = min(best, time.perf_counter() - t)
+        results[name + '_mb_per_s'] = size / best
+
+    print('{:.1f} MB, identical output: {:.1f} -> {:.1f} MB/s'.format(size, results['before_mb_per_s'], results['after_mb_per_s']))
+    return results
+
+
+adversarial_lines = {
+    'no_punctuation': lambda n: 'слово ' * (n // 6),
+    'dots': lambda n: 'а' + '.' * n,
+    'quoted_dots': lambda n: "а'" + ".'" * (n // 2),
+    'dash_continued': lambda n: 'а. - б' * (n // 6),
+    'dash_broken': lambda n: 'а!? -' * (n // 5),
+    'quotes': lambda n: "'" * n,
+    'leading_dashes': lambda n: ' -' * (n // 2),
+    'long_run_then_dash': lambda n: 'а' + '!' * n + ' - а',
+}
+
+
+def bench_sentences(sizes=(25000, 50000, 100000, 200000), repeat=3, tolerance=1.5):
+    from text_prepare_sentences import p, split_sentences
+
+    rnd = random.Random(5)
+    alphabet = list(".!?'  - -\nаАяЯёЁ09́zбБ,")
+    for line in [''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 30))) for _ in range(200000)] + synthetic_text(3000):
+        if p.findall(line) != split_sentences(line):
+            raise Exception('different sentences', repr(line))
+
+    def best(fn, text):
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            fn(text)
+            times.append(time.perf_counter() - t)
+        return min(times)
+
+    results = {}
+    text = ''.join(synthetic_text(5000))
+    results['text'] = {'regex_ms': best(p.findall, text) * 1000, 'scanner_ms': best(split_sentences, text) * 1000}
+    print('{:20} regex {:9.2f} ms   scanner {:9.2f} ms'.format('synthetic text', results['text']['regex_ms'], results['text']['scanner_ms']))
+
+    # time per character at each size, a constant column is linear behavior
+    for name, make in adversarial_lines.items():
+        results[name] = []
+        for n in sizes:
+            line = make(n)
+            if p.findall(line) != split_sentences(line):
+                raise Exception('different sentences', name, n)
+            results[name].append({'chars': len(line),
+                                  'regex_ns_per_char': best(p.findall, line) / len(line) * 1e9,
+                                  'scanner_ns_per_char': best(split_sentences, line) / len(line) * 1e9})
+        print('{:20} regex {} ns/char   scanner {} ns/char'.format(
+            name, ' '.join('{:6.1f}'.format(r['regex_ns_per_char']) for r in results[name]),
+            ' '.join('{:6.1f}'.format(r['scanner_ns_per_char']) for r in results[name])))
+
+    # the scanner has to keep up with the regex it replaced on every kind of line, and stay linear; sums over
+    # the sizes and a factor of 8 in length leave room for timing noise
+    ok = True
+    for name in adversarial_lines:
+        regex = sum(r['regex_ns_per_char'] for r in results[name])
+        scanner = sum(r['scanner_ns_per_char'] for r in results[name])
+        if scanner > tolerance * regex:
+            print('{}: the scanner is {:.1f}x slower than the regex'.format(name, scanner / regex))
+            ok = False
+        first, last = results[name][0]['scanner_ns_per_char'], results[name][-1]['scanner_ns_per_char']
+        if last > 2 * tolerance * first:
+            print('{}: the scanner takes {:.1f}x longer per character on a {}x longer line'.format(
+                name, last / first, sizes[-1] // sizes[0]))
+            ok = False
+
+    return results, ok
+
+
+import_script = '''
+import importlib, json, sys, time
+t = time.perf_counter()
+try:
+    importlib.import_module(sys.argv[1])
+    print(json.dumps({'s': time.perf_counter() - t}))
+except Exception as e:
+    print(json.dumps({'error': '{}: {}'.format(type(e).__name__, e)}))
+'''
+
+first_use_script = '''
+import json, time
+import text_prepare as tp
+from lazy import load, load_times
+
+errors = {}
+for name in ['acc_dict', 'wiktparser', 'morph', 'predictor', 'your_accentor', 'parser']:
+    try:
+        load(getattr(tp, name))
+    except Exception as e:
+        errors[name] = '{}: {}'.format(type(e).__name__, e)
+print(json.dumps({'load_s': load_times, 'errors': errors}))
+'''
+
+heavy_dependencies = ['pymorphy2', 'rnnmorph.predictor', 'russian_g2p.Accentor', 'wiktionaryparser', 'wikitextparser',
+                      'lxml.etree', 'requests', 'tqdm', 'dawg_python', 'wiktparser', 'dict_parser', 'text_prepare_sentences',
+                      'text_prepare']
+
+
+def run_script(script, *args):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, '-c', script] + list(args), capture_output=True, text=True, env=env).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def bench_imports(budget=1.0, first_use=False):
+    # every module in a fresh interpreter, so each figure includes everything it pulls in
+    results = {}
+    for name in heavy_dependencies:
+        results[name] = run_script(import_script, name)
+        r = results[name]
+        print('{:24} {}'.format(name, '{:8.3f} s'.format(r['s']) if 's' in r else 'failed, ' + r['error']))
+
+    if first_use:
+        # the lazy resources of text_prepare, created from the files in the working directory
+        results['first_use'] = run_script(first_use_script)
+        for name, s in results['first_use']['load_s'].items():
+            print('first use {:14} {:8.3f} s'.format(name, s))
+        for name, e in results['first_use']['errors'].items():
+            print('first use {:14} failed, {}'.format(name, e))
+
+    cost = results['text_prepare'].get('s')
+    if cost is None or cost > budget:
+        print('text_prepare import is over the {:.2f} s budget'.format(budget))
+        return results, False
+    return results, True
+
+
+syllables = ['ма', 'ло', 'ко', 'ра', 'ве', 'ни', 'ду', 'сто', 'пре', 'жи', 'зна', 'то', 'ры', 'ча', 'ще', 'ю', 'ля', 'бо', 'гу', 'ёж',
+             'на', 'по', 'ска', 'вы', 'де', 'ли', 'мо', 'ту', 'шка', 'зе', 'ре', 'ст', 'ки', 'ной', 'ход', 'ем', 'ать', 'ий', 'ую', 'ся']
+ud_tags = ['NOUN Case=Nom|Number=Sing', 'NOUN Case=Gen|Number=Sing', 'NOUN Case=Acc|Number=Plur', 'NOUN Case=Ins|Number=Plur',
+           'ADJ Case=Nom|Degree=Pos|Number=Sing', 'ADJF Case=Acc|Number=Plur', 'VERB Mood=Ind|Number=Sing|Person=3',
+           'INFN Aspect=Perf', 'ADV Degree=Cmp', 'дом NOUN Case=Nom|Number=Sing']
+
+
+def synthetic_word(rnd):
+    return ''.join(rnd.choice(syllables) for _ in range(rnd.randint(1, 5)))
+
+
+def synthetic_words(count, seed=0):
+    rnd = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add(synthetic_word(rnd))
+    return sorted(words)
+
+
+def synthetic_text(lines, seed=0):
+    # punctuation, quotes, dashes, latin words and runs of spaces the normalizer has to deal with
+    rnd = random.Random(seed)
+    text = []
+    for _ in range(lines):
+        sentences = []
+        for _ in range(rnd.randint(1, 8)):
+            words = [synthetic_word(rnd) for _ in range(rnd.randint(2, 14))]
+            if rnd.random() < 0.2: words.insert(rnd.randrange(len(words)), rnd.choice(['Wi-Fi', 'ok', 'CD']))
+            if rnd.random() < 0.3: words.insert(rnd.randrange(1, len(words) + 1), rnd.choice(['—', '-', '–']))
+            if rnd.random() < 0.2: words[0] = '«' + words[0]; words[-1] += '»'
+            s = (' ' if rnd.random() < 0.9 else '  ').join(words)
+            sentences.append(s[0].upper() + s[1:] + rnd.choice(['.', '.', '!', '?', '…', '?!']))
+        text.append(' '.join(sentences) + '\n')
+    return text
+
+
+def synthetic_dictionary(path, accents_count=200000, homographs_count=5000, store=True):
+    import pickle
+    from accent_store import compile_accents
+
+    words = synthetic_words(accents_count + homographs_count)
+    rnd = random.Random(1)
+    accents = {w: rnd.randint(1, 4) for w in words[:accents_count]}
+    homographs = {w: [{1, 2}, {rnd.choice(ud_tags): 1, rnd.choice(ud_tags): 2}] for w in words[accents_count:]}
+
+    os.makedirs(path, exist_ok=True)
+    if store:
+        compile_accents(accents.items(), os.path.join(path, 'accents.bin'))
+    else:
+        with open(os.path.join(path, 'accents.pickle'), 'wb') as f:
+            pickle.dump(accents, f)
+    with open(os.path.join(path, 'homographs.pickle'), 'wb') as f:
+        pickle.dump(homographs, f)
+    with open(os.path.join(path, 'homographs2.pickle'), 'wb') as f:
+        pickle.dump(set(words[:1000:10]), f)
+    return accents, homographs
+
+
+def measure(fn, ops, repeat=5):
+    # best of several runs after a warm-up, per operation
+    fn()
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    times.sort()
+    return {'ops': ops, 'us_per_op': times[0] / ops * 1e6, 'median_us_per_op': times[len(times) // 2] / ops * 1e6}
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def micro_prepare_sentences(tmp):
+    from text_prepare_sentences import prepare_sentences
+
+    text = synthetic_text(2000)
+    r = measure(lambda: prepare_sentences(text), len(text))
+    r['mb_per_s'] = sum(len(line.encode('utf-8')) for line in text) / (r['us_per_op'] * len(text) / 1e6) / 2 ** 20
+    return r
+
+
+def micro_vowels(tmp):
+    from dict_parser import count_vovels, get_first_vovel_pos
+
+    words = synthetic_words(20000)
+
+    def run():
+        for w in words:
+            count_vovels(w)
+            get_first_vovel_pos(w)
+    return measure(run, len(words))
+
+
+def micro_compare_tags(tmp):
+    from dict_parser import compare_tags, split_morph
+
+    rnd = random.Random(2)
+    pairs = [split_morph(rnd.choice(ud_tags))[1:] + split_morph(rnd.choice(ud_tags))[1:] for _ in range(20000)]
+
+    def run():
+        for pos1, tag1, pos2, tag2 in pairs:
+            compare_tags(pos1, tag1, pos2, tag2)
+    return measure(run, len(pairs))
+
+
+def micro_load(tmp, store):
+    from dict_parser import Parser
+
+    path = os.path.join(tmp, 'store' if store else 'pickle')
+    if not os.path.exists(path):
+        synthetic_dictionary(path, store=store)
+
+    def run():
+        with working_directory(path), contextlib.redirect_stdout(io.StringIO()):
+            Parser(journal_path=None).load()
+    return measure(run, 1, repeat=3)
+
+
+def micro_add_homograph(tmp):
+    from dict_parser import Parser
+
+    rnd = random.Random(3)
+    words = synthetic_words(5000, seed=3)
+    pairs = [(rnd.choice(words), [rnd.randint(1, 4), rnd.choice(ud_tags + [None])]) for _ in range(20000)]
+
+    def run():
+        parser = Parser(journal_path=None)
+        parser.accents = {}
+        parser.homographs = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for word, pm in pairs:
+                parser.add_homograph(word, pm)
+    return measure(run, len(pairs), repeat=3)
+
+
+def micro_get_accent(tmp):
+    path = os.path.join(tmp, 'store')
+    if not os.path.exists(path):
+        synthetic_dictionary(path)
+
+    # the dictionary is loaded from the working directory
+    with working_directory(path), contextlib.redirect_stdout(io.StringIO()):
+        import text_prepare as tp
+        from lazy import load
+        load(tp.acc_dict)
+
+    words = random.Random(4).sample([w for w in tp.acc_dict.accents if w not in tp.acc_dict.homographs2], 20000)
+
+    def run():
+        for w in words:
+            tp.get_accent(w, [w], w)
+    return measure(run, len(words))
+
+
+def micro_table_to_2d(tmp):
+    from wikt_template_parser import html_table, table_to_2d
+
+    texts = [template_fixture('прил ru 1a', w) for w in ('но́вый', 'краси́вый', 'до́брый')]
+    texts += ['<table>' + verb_fixture(s) + '</table>' for s in ('дел', 'чит', 'игр')]
+
+    def run():
+        for text in texts:
+            table_to_2d(html_table(text))
+    return measure(run, len(texts))
+
+
+def micro_parse_template(tmp, recorded=None):
+    import wikitextparser as wtp
+    import wiktparser
+    from wikt_template_parser import parse_template
+
+    if recorded is not None:
+        with open(recorded, encoding='utf-8') as f:
+            records = json.load(f)
+    else:
+        records = [{'template': '{{' + t + '|слоги={{по-слогам|' + w + '}}}}', 'headword': w,
+                    'expansion': template_fixture(t, w)} for t, w in page_templates]
+
+    expansions = {r['template']: r['expansion'] for r in records}
+    templates = [(r['headword'], wtp.parse(r['template']).templates[0]) for r in records]
+
+    # expansions come from the fixture, so only the parsing is timed
+    expand_template = wiktparser.expand_template
+    wiktparser.expand_template = lambda template, language='ru': expansions[template.string]
+    try:
+        def run():
+            for headword, template in templates:
+                parse_template(headword, template)
+        return measure(run, len(templates))
+    finally:
+        wiktparser.expand_template = expand_template
+
+
+micro_benchmarks = [
+    ('prepare_sentences', micro_prepare_sentences),
+    ('vowels', micro_vowels),
+    ('compare_tags', micro_compare_tags),
+    ('load_pickle', lambda tmp: micro_load(tmp, False)),
+    ('load_store', lambda tmp: micro_load(tmp, True)),
+    ('add_homograph', micro_add_homograph),
+    ('get_accent', micro_get_accent),
+    ('table_to_2d', micro_table_to_2d),
+    ('parse_template', micro_parse_template),
+]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(out=None, only=None, recorded=None):
+    import platform
+    import tempfile
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, bench in micro_benchmarks:
+            if only and name not in only: continue
+            try:
+                if name == 'parse_template':
+                    results[name] = micro_parse_template(tmp, recorded)
+                else:
+                    results[name] = bench(tmp)
+            except ImportError as e:
+                # a module the benchmark needs is not installed
+                results[name] = {'skipped': str(e)}
+                print('{:20} skipped: {}'.format(name, e))
+                continue
+            print('{:20} {:12.3f} us/op   median {:12.3f}'.format(name, results[name]['us_per_op'],
+                                                                results[name]['median_us_per_op']))
+
+    report = {'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+    if out is not None:
+        with open(out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    return report
+
+
+def compare(before_path, after_path):
+    with open(before_path, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(after_path, encoding='utf-8') as f:
+        after = json.load(f)
+
+    print('{:20} {:>14} {:>14} {:>8}'.format('', before['commit'] or before_path, after['commit'] or after_path, ''))
+    for name in before['results']:
+        b, a = before['results'][name], after['results'].get(name, {})
+        if 'us_per_op' not in b or 'us_per_op' not in a: continue
+        print('{:20} {:14.3f} {:14.3f} {:7.2f}x'.format(name, b['us_per_op'], a['us_per_op'], b['us_per_op'] / a['us_per_op']))
+
+
+class StandInWiktionary(http.server.BaseHTTPRequestHandler):
+    # answers action=query the way the MediaWiki API does: normalized titles, redirects, missing pages and
+    # a continuation after max_revisions page texts
+    pages = {}
+    redirects = {}
+    max_revisions = 20
+    received = []
+
+    def do_GET(self):
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        self.received.append(params)
+
+        query = {'normalized': [], 'redirects': [], 'pages': {}}
+        titles = set()
+        for title in params['titles'].split('|'):
+            if '_' in title:
+                query['normalized'].append({'from': title, 'to': title.replace('_', ' ')})
+                title = title.replace('_', ' ')
+            if title in self.redirects:
+                query['redirects'].append({'from': title, 'to': self.redirects[title]})
+                title = self.redirects[title]
+            titles.add(title)
+
+        start = int(params.get('rvcontinue', 0))
+        for i, title in enumerate(sorted(titles)):
+            if title not in self.pages:
+                query['pages'][str(-1 - i)] = {'title': title, 'missing': ''}
+            elif start <= i < start + self.max_revisions:
+                query['pages'][str(i)] = {'title': title, 'revisions': [{'*': self.pages[title]}]}
+            else:
+                query['pages'][str(i)] = {'title': title}
+
+        resp = {'query': query}
+        if len(titles) > start + self.max_revisions:
+            resp['continue'] = {'rvcontinue': str(start + self.max_revisions), 'continue': '||'}
+
+        body = json.dumps(resp, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_wiki(count=120, hits=20000):
+    # the Wiktionary client and its page cache against a local stand-in for the API
+    import sqlite3
+    import tempfile
+    import wiktparser
+    from wiki_cache import WikiCache
+
+    words = synthetic_words(count, seed=2)
+    pages = {w: '{{по-слогам|' + w + '}}' for w in words}
+    phrase = words[0] + ' ' + words[1]
+    pages[phrase] = '{{по-слогам|' + phrase + '}}'
+    # a page that only points at another one, followed by get_wikitexts itself
+    pages['отсылка'] = '#REDIRECT [[' + words[2] + ']]'
+    redirects = {'вариант' + w: w for w in words[:5]}
+    missing = ['нет' + w for w in words[:5]]
+
+    queries = words + [words[0] + '_' + words[1], 'отсылка'] + list(redirects) + missing
+    expected = {w: pages[w] for w in words}
+    expected.update({words[0] + '_' + words[1]: pages[phrase], 'отсылка': pages[words[2]]})
+    expected.update({r: pages[w] for r, w in redirects.items()})
+    expected.update({w: '' for w in missing})
+
+    StandInWiktionary.pages = pages
+    StandInWiktionary.redirects = redirects
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInWiktionary)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    saved = wiktparser.api_url, wiktparser.wiki_cache, wiktparser.wiki_dump
+    failures = []
+
+    def check(name, ok, note=''):
+        print('{:44} {} {}'.format(name, 'ok' if ok else 'FAILED', note))
+        if not ok: failures.append(name)
+
+    def fetch(titles):
+        StandInWiktionary.received = []
+        t = time.perf_counter()
+        result = wiktparser.get_wikitexts(titles)
+        return result, StandInWiktionary.received, time.perf_counter() - t
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            wiktparser.api_url = 'http://127.0.0.1:{}/{{}}/w/api.php'.format(server.server_address[1])
+            wiktparser.wiki_dump = None
+            cache = wiktparser.wiki_cache = WikiCache(os.path.join(tmp, 'wiki_cache.sqlite'))
+
+            result, received, t = fetch(queries)
+            batches = [r for r in received if 'rvcontinue' not in r]
+            check('cold: pages, redirects, missing', result == expected, '{:.3f} s'.format(t))
+            check('cold: at most 50 titles per request', all(len(r['titles'].split('|')) <= 50 for r in received))
+            check('cold: one batch per 50 titles', len(batches) == (len(queries) + 49) // 50,
+                  '{} requests, {} continued'.format(len(received), len(received) - len(batches)))
+
+            result, received, t = fetch(queries)
+            check('warm: same pages from the cache', result == expected, '{:.3f} s'.format(t))
+            check('warm: no requests', len(received) == 0)
+
+            cache.flush()
+            db = sqlite3.connect(cache.path)
+            touched = db.execute('SELECT COUNT(*) FROM pages WHERE accessed > fetched').fetchone()[0]
+            db.close()
+            check('warm: access times written on flush', touched >= len(words))
+
+            cache.offline = True
+            result, received, t = fetch(['ещё' + w for w in words[:10]])
+            check('offline: unknown pages are empty', all(v == '' for v in result.values()))
+            check('offline: no requests', len(received) == 0)
+            cache.offline = False
+
+            cache.ttl = 0
+            result, received, t = fetch(words[:10])
+            check('expired: fetched again', len(received) > 0 and result == {w: pages[w] for w in words[:10]})
+            cache.ttl = 30 * 24 * 3600
+
+            small = WikiCache(os.path.join(tmp, 'small.sqlite'), max_entries=10)
+            small.put_many({w: pages[w] for w in words[:50]})
+            check('max_entries: oldest pages evicted', small.db().execute('SELECT COUNT(*) FROM pages').fetchone()[0] == 10)
+            small.close()
+
+            t = time.perf_counter()
+            for i in range(hits):
+                cache.get(words[i % len(words)])
+            t = time.perf_counter() - t
+            print('cache hit {:.2f} us'.format(t / hits * 1e6))
+            cache.close()
+    finally:
+        wiktparser.api_url, wiktparser.wiki_cache, wiktparser.wiki_dump = saved
+        server.shutdown()
+        server.server_close()
+
+    return len(failures) == 0
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__('localhost')
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.unix_path)
+
+
+def latencies_ms(times):
+    times = sorted(times)
+    return {'requests': len(times), 'mean_ms': sum(times) / len(times) * 1000,
+            'p50_ms': times[len(times) // 2] * 1000, 'p90_ms': times[int(len(times) * 0.9)] * 1000,
+            'p99_ms': times[int(len(times) * 0.99)] * 1000, 'max_ms': times[-1] * 1000}
+
+
+def bench_server(count=2000, clients=8, tcp=False):
+    # accent_server.py on a synthetic dictionary, texts the dictionary answers alone so no model is involved
+    import tempfile
+
+    import pickle
+    from accent_store import compile_accents
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # the rendered accent has to fall on a vowel, unlike in synthetic_dictionary
+        rnd = random.Random(6)
+        words = [w for w in synthetic_words(50000, seed=7) if 'ё' not in w]
+        accents = {}
+        for w in words:
+            vowels = [i + 1 for i, c in enumerate(w) if c in 'аеиоуыэюя']
+            if len(vowels) > 1: accents[w] = rnd.choice(vowels)
+        words = sorted(accents)
+        compile_accents(accents.items(), os.path.join(tmp, 'accents.bin'))
+        with open(os.path.join(tmp, 'homographs.pickle'), 'wb') as f:
+            pickle.dump({}, f)
+        with open(os.path.join(tmp, 'homographs2.pickle'), 'wb') as f:
+            pickle.dump(set(), f)
+
+        texts = []
+        for _ in range(200):
+            sentence = ' '.join(rnd.choice(words) for _ in range(rnd.randint(5, 15)))
+            texts.append(sentence[0].upper() + sentence[1:] + '.')
+
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'accent_server.py')
+        if tcp:
+            with socket.socket() as s:
+                s.bind(('127.0.0.1', 0))
+                port = s.getsockname()[1]
+            command = ['serve', '--port', str(port), '--no-models']
+            connect = lambda: http.client.HTTPConnection('127.0.0.1', port)
+        else:
+            path = os.path.join(tmp, 'accent.sock')
+            command = ['serve', '--unix', path, '--no-models']
+            connect = lambda: UnixConnection(path)
+
+        log = open(os.path.join(tmp, 'server.log'), 'w')
+        server = subprocess.Popen([sys.executable, script] + command, cwd=tmp, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            t = time.perf_counter()
+            while True:
+                if server.poll() is not None:
+                    raise Exception('server exited', open(log.name).read())
+                try:
+                    c = connect()
+                    c.request('GET', '/health')
+                    c.getresponse().read()
+                    c.close()
+                    break
+                except OSError:
+                    time.sleep(0.05)
+            print('server ready in {:.2f} s ({})'.format(time.perf_counter() - t, 'tcp' if tcp else 'unix socket'))
+
+            def run(n, seed, times, connects):
+                c = connect()
+                t = time.perf_counter()
+                c.connect()
+                connects.append(time.perf_counter() - t)
+                rnd = random.Random(seed)
+                for _ in range(n):
+                    body = json.dumps({'texts': [rnd.choice(texts)]}, ensure_ascii=False).encode('utf-8')
+                    t = time.perf_counter()
+                    c.request('POST', '/accent', body, {'Content-Type': 'application/json'})
+                    resp = c.getresponse()
+                    data = resp.read()
+                    times.append(time.perf_counter() - t)
+                    if resp.status != 200:
+                        raise Exception('request failed', resp.status, data)
+                c.close()
+
+            # one keep-alive client: the latency of a single request
+            run(100, 0, [], [])
+            times = []
+            run(count, 1, times, [])
+            results = {'sequential': latencies_ms(times)}
+
+            # several clients at once, each on its own connection; connecting is timed apart from the requests
+            times = []
+            connects = []
+            threads = [threading.Thread(target=run, args=(count // clients, 2 + i, times, connects)) for i in range(clients)]
+            t = time.perf_counter()
+            for thread in threads: thread.start()
+            for thread in threads: thread.join()
+            elapsed = time.perf_counter() - t
+            results['concurrent'] = dict(latencies_ms(times), clients=clients, requests_per_s=len(times) / elapsed)
+            results['connect'] = latencies_ms(connects)
+        finally:
+            server.terminate()
+            server.wait()
+            log.close()
+
+    for name, r in results.items():
+        print('{:12} {:6d} requests   mean {:7.3f} ms   p50 {:7.3f}   p90 {:7.3f}   p99 {:7.3f}   max {:7.3f} ms'.format(
+            name, r['requests'], r['mean_ms'], r['p50_ms'], r['p90_ms'], r['p99_ms'], r['max_ms']))
+    print('{} clients: {:.0f} requests/s'.format(clients, results['concurrent']['requests_per_s']))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Performance benchmarks.')
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+
+    p = subparsers.add_parser('load', help='accents.pickle against the memory-mapped store')
+    p.add_argument('--pickle', default=r'accents.pickle')
+    p.add_argument('--store', default=r'accents.bin')
+
+    p = subparsers.add_parser('rnn', help='per-occurrence against batched homograph disambiguation')
+    p.add_argument('file')
+    p.add_argument('--limit', type=int)
+
+    p = subparsers.add_parser('tables', help='BeautifulSoup against lxml inflection table extraction')
+    p.add_argument('--recorded', help='expansions saved by wikt_inflection.py record, synthetic tables otherwise')
+    p.add_argument('--repeat', type=int, default=200)
+
+    p = subparsers.add_parser('pages', help='time and tracemalloc figures of parsing inflection pages')
+    p.add_argument('--count', type=int, default=300)
+
+    p = subparsers.add_parser('normalize', help='replace chain against the compiled normalizer, in MB/s')
+    p.add_argument('file', nargs='?', help='a large book, synthetic text otherwise')
+
+    p = subparsers.add_parser('sentences', help='the sentence regex against split_sentences on adversarial lines')
+
+    p = subparsers.add_parser('imports', help='import cost per dependency and the text_prepare import budget')
+    p.add_argument('--budget', type=float, default=1.0, help='seconds text_prepare may take to import')
+    p.add_argument('--first-use', action='store_true', help='also time creating the dictionary and the models')
+
+    p = subparsers.add_parser('wiki', help='the Wiktionary client and its page cache against a local stand-in API')
+    p.add_argument('--count', type=int, default=120, help='pages on the stand-in')
+
+    p = subparsers.add_parser('server', help='per-request latency of accent_server.py on dictionary-only texts')
+    p.add_argument('-n', '--requests', type=int, default=2000)
+    p.add_argument('-c', '--clients', type=int, default=8, help='connections at once in the concurrent run')
+    p.add_argument('--tcp', action='store_true', help='listen on a local port instead of a Unix socket')
+
+    p = subparsers.add_parser('suite', help='offline micro-benchmarks on synthetic fixtures')
+    p.add_argument('-o', '--output', help='write the results as JSON, e.g. bench-<commit>.json')
+    p.add_argument('--only', nargs='+', choices=[name for name, _ in micro_benchmarks])
+    p.add_argument('--recorded', help='expansions saved by wikt_inflection.py record for parse_template')
+
+    p = subparsers.add_parser('compare', help='per-benchmark speedup between two suite results')
+    p.add_argument('before')
+    p.add_argument('after')
+
+    args = parser.parse_args()
+
+    if args.bench == 'load':
+        bench_load(args.pickle, args.store)
+    if args.bench == 'rnn':
+        bench_disambiguation(args.file, args.limit)
+    if args.bench == 'tables':
+        bench_tables(args.recorded, args.repeat)
+    if args.bench == 'pages':
+        bench_pages(args.count)
+    if args.bench == 'normalize':
+        bench_normalize(args.file)
+    if args.bench == 'sentences':
+        if not bench_sentences()[1]:
+            sys.exit(1)
+    if args.bench == 'imports':
+        if not bench_imports(args.budget, args.first_use)[1]:
+            sys.exit(1)
+    if args.bench == 'wiki':
+        if not bench_wiki(args.count):
+            sys.exit(1)
+    if args.bench == 'server':
+        bench_server(args.requests, args.clients, args.tcp or not hasattr(socket, 'AF_UNIX'))
+    if args.bench == 'suite':
+        run_suite(args.output, args.only, args.recorded)
+    if args.bench == 'compare':
+        compare(args.before, args.after)
@@ -0,0 +1,154 @@
+import argparse
+import collections
+import json
+import os
+
+russian_vowels = set('аоуэыияёюеАОУЭЫИЯЁЮЕ')
+
+
+def write_record(f, sentence_id, offset, word, candidates, sentence):
+    f.write(json.dumps({'id': sentence_id, 'offset': offset, 'word': word,
+                        'candidates': candidates, 'sentence': sentence}, ensure_ascii=False))
+    f.write('\n')
+
+
+def load_queue(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if len(line.strip()) > 0]
+
+
+def group_key(record):
+    return record['word'].lower() + '|' + ','.join(str(c) for c in record['candidates'])
+
+
+def group_queue(records):
+    groups = collections.OrderedDict()
+    for r in records:
+        groups.setdefault(group_key(r), []).append(r)
+    return groups
+
+
+def load_answers(path):
+    if not os.path.exists(path): return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_answers(answers, path):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(answers, f, ensure_ascii=False, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def review(queue_path, answers_path):
+    answers = load_answers(answers_path)
+    groups = group_queue(load_queue(queue_path))
+
+    # most frequent words first, one answer covers the whole group
+    for key, records in sorted(groups.items(), key=lambda x: -len(x[1])):
+        if key in answers: continue
+
+        word = records[0]['word']
+        print(word, len(records), 'occurrences, candidates:', records[0]['candidates'] or 'any vowel')
+        for r in records[:3]:
+            print('   ', r['sentence'].strip())
+
+        value = ask_position(word)
+        if value == 'q': break
+        if value is None: continue
+
+        answers[key] = value
+        save_answers(answers, answers_path)
+
+    return answers
+
+
+def ask_position(word):
+    # 1-based position of a vowel of the word, None to skip it, 'q' to stop
+    while True:
+        value = input('Введите ударение (пусто - пропустить, q - выход): ').strip()
+        if value == 'q': return value
+        if len(value) == 0: return None
+        if value.isdigit() and is_accent_position(word, int(value)): return int(value)
+        print('нет гласной на позиции', value, 'в слове', word)
+
+
+def is_accent_position(word, pos):
+    return isinstance(pos, int) and 0 < pos <= len(word) and word[pos - 1] in russian_vowels
+
+
+def accent_word(word, pos):
+    if not is_accent_position(word, pos):
+        raise ValueError('no vowel at accent position', word, pos)
+    return word[:pos] + '́' + word[pos:]
+
+
+def apply(output_path, queue_path, answers_path, patched_path=None, block=1 << 20):
+    answers = load_answers(answers_path)
+    patches = sorted((r['offset'], r['word'], answers[group_key(r)])
+                     for r in load_queue(queue_path) if group_key(r) in answers)
+
+    patched_path = patched_path or output_path
+    tmp = patched_path + '.tmp'
+    applied = 0
+
+    try:
+        with open(output_path, encoding='utf-8') as f_in, open(tmp, 'w', encoding='utf-8') as f_out:
+            position = 0
+
+            def copy(count):
+                nonlocal position
+                while count > 0:
+                    data = f_in.read(min(count, block))
+                    if len(data) == 0: return
+                    f_out.write(data)
+                    position += len(data)
+                    count -= len(data)
+
+            for offset, word, pos in patches:
+                copy(offset - position)
+                found = f_in.read(len(word))
+                position += len(found)
+
+                if found != word:
+                    print('output does not match the queue', offset, word, found)
+                    f_out.write(found)
+                elif not is_accent_position(word, pos):
+                    # an answers file from an older review or edited by hand
+                    print('no vowel at accent position, skipped', offset, word, pos)
+                    f_out.write(found)
+                else:
+                    f_out.write(accent_word(word, pos))
+                    applied += 1
+
+            copy(float('inf'))
+
+        os.replace(tmp, patched_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    print(applied, 'of', len(patches), 'answers applied')
+    return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Review and apply deferred accents.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('review', help='answer each word once for all of its occurrences')
+    p.add_argument('queue')
+    p.add_argument('answers')
+
+    p = subparsers.add_parser('apply', help='patch the accented output with the answers')
+    p.add_argument('output')
+    p.add_argument('queue')
+    p.add_argument('answers')
+    p.add_argument('-o', '--patched', help='write the patched text here instead of in place')
+
+    args = parser.parse_args()
+
+    if args.command == 'review':
+        review(args.queue, args.answers)
+    if args.command == 'apply':
+        apply(args.output, args.queue, args.answers, args.patched)
@@ -1,15 +1,26 @@
+import collections
+import contextlib
+import functools
+import io
 import json
+import os
 import pickle
 import re
-import tqdm as tqdm
+import sys
+import threading
+import time
+from collections import namedtuple
 
-import dawg_python as dawg
+from accent_store import AccentStore
+from lazy import Lazy, lazy_import
 
-import pymorphy2 as pymorphy2
+dawg = lazy_import('dawg_python', __name__, 'dawg')
 
-from wiktparser import parse_wikt_ru
+def load_morpher():
+    import pymorphy2
+    return pymorphy2.MorphAnalyzer()
 
-morpher = pymorphy2.MorphAnalyzer()
+morpher = Lazy(load_morpher, __name__, 'morpher')
 
 # from russian_g2p.Accentor import Accentor
 # your_accentor = Accentor(mode='many')
@@ -40,186 +51,310 @@ def get_first_vovel_pos(word):
 # for k in homographs:
 #     homographs[k] = [homographs[k], {}]
 
-def compare_tags(pos1, tag1, pos2, tag2, strict=False):
-    synonims =[['DET', 'ADJ', 'ADJS', 'ADJF'],
-               ['ADVB', 'ADV'],
-               ['VERB', 'GRND', 'INFN']]
-    if pos1 != pos2:
-        fl = False
-        for syn in synonims:
-            if pos1 in syn and pos2 in syn:
-                fl = True
-                break
-        if not fl: return False
-
-    tag1 = tag1.replace('_', '')
-    tag2 = tag2.replace('_', '')
-
-    tags_dict1 = tag1.split('|')
-    tags_dict2 = tag2.split('|')
-
-    tags_dict1 = {x.split('=')[0]: x.split('=')[1] for x in tags_dict1 if len(x) > 0}
-    tags_dict2 = {x.split('=')[0]: x.split('=')[1] for x in tags_dict2 if len(x) > 0}
-
-    for key in tags_dict1:
-        if key == 'Number':
-            if not key in tags_dict2:
-                return False
-            if tags_dict1[key] == 'Sing' and tags_dict2[key] != 'Sing':
-                return False
-            if tags_dict1[key] != 'Sing' and tags_dict2[key] == 'Sing':
-                return False
+pos_synonyms = [['DET', 'ADJ', 'ADJS', 'ADJF'],
+                ['ADVB', 'ADV'],
+                ['VERB', 'GRND', 'INFN']]
+pos_groups = {pos: i for i, syn in enumerate(pos_synonyms) for pos in syn}
+
+tag_number = 1
+tag_degree = 2
+tag_case = 4
+
+_values = {}
+# accent_server compiles tags from several threads, two of them must never give out the same bit or group
+_bits_lock = threading.Lock()
+
+def _value_bit(value):
+    with _bits_lock:
+        if value not in _values:
+            _values[value] = 1 << len(_values)
+        return _values[value]
+
+def _pos_group(pos):
+    with _bits_lock:
+        if pos not in pos_groups:
+            pos_groups[pos] = len(pos_groups)
+        return pos_groups[pos]
+
+case_nom_from = _value_bit('Nom') | _value_bit('Acc') | _value_bit('Nomn')
+case_nom_to = _value_bit('Nom') | _value_bit('Acc')
+case_oblique = _value_bit('Gen') | _value_bit('Dat') | _value_bit('Ins')
+
+CompiledTag = namedtuple('CompiledTag', ['group', 'mask', 'number', 'degree', 'case'])
+
+@functools.lru_cache(maxsize=None)
+def compile_tag(pos, tag):
+    mask = number = degree = case = 0
+    for x in tag.replace('_', '').split('|'):
+        kv = x.split('=')
+        if len(kv) < 2: continue
+
+        if kv[0] == 'Number':
+            mask |= tag_number
+            number = 1 if kv[1] == 'Sing' else 2
+        elif kv[0] == 'Degree':
+            mask |= tag_degree
+            degree = _value_bit(kv[1])
+        elif kv[0] == 'Case':
+            mask |= tag_case
+            case = _value_bit(kv[1])
+
+    return CompiledTag(_pos_group(pos), mask, number, degree, case)
+
+def compare_compiled_tags(t1, t2, strict=False):
+    if t1.group != t2.group: return False
+
+    required = t1.mask & (tag_number | tag_degree | tag_case if strict else tag_number | tag_degree)
+    if required & ~t2.mask: return False
+
+    if t1.mask & tag_number and t1.number != t2.number: return False
+    if t1.mask & tag_degree and t1.degree != t2.degree: return False
+
+    if t1.mask & t2.mask & tag_case and t1.case != t2.case:
+        if strict: return False
+        if not (t1.case & case_nom_from and t2.case & case_nom_to or t1.case & case_oblique and t2.case & case_oblique):
+            return False
 
-        if key == 'Degree':
-            if not key in tags_dict2:
-                return False
-            if tags_dict1[key] != tags_dict2[key]:
+    return True
+
+def compare_tags(pos1, tag1, pos2, tag2, strict=False):
+    return compare_compiled_tags(compile_tag(pos1, tag1), compile_tag(pos2, tag2), strict)
+
+@functools.lru_cache(maxsize=None)
+def split_morph(m):
+    splits = m.split()
+
+    if len(splits) == 1:
+        return None, splits[0], ''
+    if len(splits) == 2:
+        if '=' in splits[1]:
+            return None, splits[0], splits[1]
+        return splits[0], splits[1], ''
+    return splits[0], splits[1], splits[2]
+
+# the way homograph keys are read when resolving predicted forms
+def compile_homograph_key(m):
+    splits = m.split()
+    return compile_tag(splits[0], splits[1] if len(splits) > 1 else '')
+
+def new_homograph(pms):
+    forms = [set(), {}]
+    for p, m in pms:
+        forms[0].add(p)
+
+        if m is not None:
+            forms[1][m] = p
+    return forms
+
+def add_form_position(forms, m, p):
+    if m in forms[1]:
+        if isinstance(forms[1][m], int):
+            forms[1][m] = {forms[1][m], p}
+        else: forms[1][m].add(p)
+    else:
+        forms[1][m] = p
+
+def quiet(*args):
+    pass
+
+# one (position, morph) pair against an existing [positions, {morph: position}] entry
+def merge_homograph(word, forms, p, m, log=print):
+    if p in forms[0]:
+        if m is None: return False
+
+        m_base, m_pos, m_tag = split_morph(m)
+        m_compiled = compile_tag(m_pos, m_tag)
+
+        for key in forms[1]:
+            base, pos, tag = split_morph(key)
+
+            if compare_compiled_tags(compile_tag(pos, tag), m_compiled, True):
+                if forms[1][key] != p: continue
+                if base is None and m_base is not None:
+                    forms[1].pop(key)
+                    forms[1][m] = p
+                    log('added base', m, word)
+                    return True
                 return False
 
-        if key == 'Case':
-            if strict:
-                if not key in tags_dict2:
-                    return False
-                if tags_dict1[key] != tags_dict2[key]:
-                    return False
-            else:
-                if key in tags_dict2:
-                    if tags_dict1[key] != tags_dict2[key]:
-                        fl = False
-                        if tags_dict1[key] in ['Nom', 'Acc', 'Nomn'] and tags_dict2[key] in ['Nom', 'Acc']: fl = True
-                        if tags_dict1[key] in ['Gen', 'Dat', 'Ins'] and tags_dict2[key] in ['Gen', 'Dat', 'Ins']: fl = True
-                        if not fl:
-                            return False
+        # new form for same position
+        if m in forms[1]:
+            add_form_position(forms, m, p)
+            log(forms)
+        else:
+            forms[1][m] = p
+        log('new form', word, p, m)
+        return True
 
+    forms[0].add(p)
 
+    if m is not None:
+        if m in forms[1]:
+            add_form_position(forms, m, p)
+            log(forms)
+        else:
+            forms[1][m] = p
 
+    log('new homograph', word, p, m)
     return True
 
+def journaled(method):
+    # only the outermost call is recorded, nested mutations are reproduced by replaying it
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        if self.replaying or self.journal_depth > 0:
+            return method(self, *args)
+
+        changed, self.changed = self.changed, False
+        self.journal_depth += 1
+        try:
+            result = method(self, *args)
+        finally:
+            self.journal_depth -= 1
+            if self.changed:
+                self.journal.append([method.__name__, args])
+            self.changed = self.changed or changed
+
+        if len(self.journal) >= self.journal_batch:
+            self.flush_journal()
+        return result
+
+    return wrapper
+
+
+def dump_atomic(obj, path):
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
 class Parser():
-    def __init__(self):
+    def __init__(self, journal_path=r'dict.journal', journal_batch=100):
         self.accents = []
         self.homographs = []
         self.homographs2 = set()
         self.changed = False
 
+        self.journal_path = journal_path
+        self.journal_batch = journal_batch
+        self.journal = []
+        self.journal_depth = 0
+        self.replaying = False
+
+        # word -> (compiled homograph keys, memo of predicted tag -> accent position)
+        self.homograph_tables = {}
+
     def load(self):
-        with open(r'accents.pickle', 'rb') as f:
-            self.accents = pickle.load(f)
+        if os.path.exists(r'accents.bin'):
+            self.accents = AccentStore(r'accents.bin')
+        else:
+            with open(r'accents.pickle', 'rb') as f:
+                self.accents = pickle.load(f)
         with open(r'homographs.pickle', 'rb') as f:
             self.homographs = pickle.load(f)
         with open(r'homographs2.pickle', 'rb') as f:
             self.homographs2 = set(pickle.load(f))
 
+        replayed = self.replay_journal()
+
+        self.homograph_tables = {}
+        for word in self.homographs:
+            self.compile_homograph(word)
+
         self.start_size = (len(self.accents), len(self.homographs), len(self.homographs2))
-        print(*self.start_size)
+        # stdout may be the accented text itself (text_prepare.py -)
+        print(*self.start_size, replayed, file=sys.stderr)
 
-    def save(self):
-        with open(r'accents.pickle', 'wb') as f:
-            pickle.dump(self.accents, f)
-        with open(r'homographs.pickle', 'wb') as f:
-            pickle.dump(self.homographs, f)
-        with open(r'homographs2.pickle', 'wb') as f:
-            pickle.dump(self.homographs2, f)
+    def replay_journal(self):
+        if self.journal_path is None or not os.path.exists(self.journal_path): return 0
+
+        with open(self.journal_path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                # torn write at the end of the journal
+                f.truncate(end)
+
+        count = 0
+        self.replaying = True
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                for line in data[:end].decode('utf-8').splitlines():
+                    name, args = json.loads(line)
+                    getattr(self, name)(*args)
+                    count += 1
+        finally:
+            self.replaying = False
+
+        self.changed = False
+        return count
+
+    def flush_journal(self):
+        if self.journal_path is None or len(self.journal) == 0: return
+
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            for record in self.journal:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.journal = []
 
+    def apply_journal(self, records):
+        for name, args in records:
+            getattr(self, name)(*args)
+
+    def save(self):
+        self.flush_journal()
         print(len(self.accents) - self.start_size[0], len(self.homographs) - self.start_size[1], len(self.homographs2) - self.start_size[2])
 
+    def compact(self):
+        self.flush_journal()
+
+        if isinstance(self.accents, AccentStore):
+            self.accents.save()
+        else:
+            dump_atomic(self.accents, r'accents.pickle')
+        dump_atomic(self.homographs, r'homographs.pickle')
+        dump_atomic(self.homographs2, r'homographs2.pickle')
+
+        # records that survive a crash before this point are no-ops on the new snapshot
+        if self.journal_path is not None and os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def compile_homograph(self, word):
+        table = [(compile_homograph_key(m), p) for m, p in self.homographs[word][1].items()]
+        self.homograph_tables[word] = (table, {})
+        return self.homograph_tables[word]
+
+    def resolve_homograph(self, word, pos, tag):
+        table, decisions = self.homograph_tables.get(word) or self.compile_homograph(word)
+
+        predicted = compile_tag(pos, tag)
+        if predicted not in decisions:
+            decisions[predicted] = next((p for key, p in table if compare_compiled_tags(key, predicted)), None)
+        return decisions[predicted]
+
+    @journaled
     def add_homograph(self, word, *pms):
         if count_vovels(word) < 2: return
         self.accents.pop(word, None)
+        self.homograph_tables.pop(word, None)
 
         if word in self.homographs:
             for p, m in pms:
-                if p in self.homographs[word][0]:
-                    if m is not None:
-                        found = False
-
-                        splits = m.split()
-
-                        if len(splits) == 1:
-                            m_base = None
-                            m_pos = splits[0]
-                            m_tag = ''
-                        if len(splits) == 2:
-                            if '=' in splits[1]:
-                                m_base = None
-                                m_pos = splits[0]
-                                m_tag = splits[1]
-                            else:
-                                m_base = splits[0]
-                                m_pos = splits[1]
-                                m_tag = ''
-                        else:
-                            m_base = splits[0]
-                            m_pos = splits[1]
-                            m_tag = splits[2]
-
-                        for key in self.homographs[word][1]:
-                            splits = key.split()
-
-                            if len(splits) == 1:
-                                base = None
-                                pos = splits[0]
-                                tag = ''
-                            if len(splits) == 2:
-                                if '=' in splits[1]:
-                                    base = None
-                                    pos = splits[0]
-                                    tag = splits[1]
-                                else:
-                                    base = splits[0]
-                                    pos = splits[1]
-                                    tag = ''
-                            else:
-                                base = splits[0]
-                                pos = splits[1]
-                                tag = splits[2]
-
-                            if compare_tags(pos, tag, m_pos, m_tag, True):
-                                if self.homographs[word][1][key] != p: continue
-                                if base is None and m_base is not None:
-                                    self.homographs[word][1].pop(key)
-                                    self.homographs[word][1][m] = p
-                                    self.changed = True
-                                    print('added base', m, word)
-                                found = True
-                                break
-
-                        if not found:
-                            # new form for same position
-                            if m in self.homographs[word][1]:
-                                if isinstance(self.homographs[word][1][m], int):
-                                    self.homographs[word][1][m] = {self.homographs[word][1][m], p}
-                                else: self.homographs[word][1][m].add(p)
-                                print(self.homographs[word])
-                            else:
-                                self.homographs[word][1][m] = p
-                            self.changed = True
-                            print('new form', word, p, m)
-
-                else:
-                    self.homographs[word][0].add(p)
-
-                    if m is not None:
-                        if m in self.homographs[word][1]:
-                            self.homographs[word][1][m] = {self.homographs[word][1][m], p}
-                            print(self.homographs[word])
-                        else:
-                            self.homographs[word][1][m] = p
-
+                if merge_homograph(word, self.homographs[word], p, m):
                     self.changed = True
-                    print('new homograph', word, p, m)
 
         else:
-            self.homographs[word] = [set(), {}]
-            for p, m in pms:
-                self.homographs[word][0].add(p)
-
-                if m is not None:
-                    self.homographs[word][1][m] = p
-
+            self.homographs[word] = new_homograph(pms)
             self.changed = True
             print('new homograph', word, self.homographs[word])
 
+    @journaled
     def add_accent(self, f, pos):
         if count_vovels(f) < 2: return
         if f in self.accents:
@@ -233,35 +368,47 @@ class Parser():
                 self.changed = True
                 print('new accent', f, pos)
 
+    @journaled
     def add_homograph2(self, word):
         if count_vovels(word) < 2: return
         self.accents.pop(word, None)
         self.homographs.pop(word, None)
+        self.homograph_tables.pop(word, None)
 
         if word not in self.homographs2:
-            self.homographs2.append(word)
+            self.homographs2.add(word)
             self.changed = True
             print('new homographs2', word)
 
 
+    @journaled
     def clean_homographs(self):
         for k in list(self.homographs):
             if len(self.homographs[k][0]) == 1:
                 data = self.homographs.pop(k)
+                self.homograph_tables.pop(k, None)
+                self.changed = True
                 if count_vovels(k) > 1:
                     self.add_accent(k, list(data[0])[0])
 
+    @journaled
     def clean_accents(self):
         for k in list(self.accents):
             if count_vovels(k) == 1:
                 self.accents.pop(k)
+                self.changed = True
                 print(k)
 
     def save_if_changed(self):
         if self.changed:
             self.save()
 
+    @journaled
     def remove_homograph(self, word, p):
+        if word not in self.homographs or p not in self.homographs[word][0]: return
+
+        self.changed = True
+        self.homograph_tables.pop(word, None)
         self.homographs[word][0].remove(p)
         for m in list(self.homographs[word][1]):
             if self.homographs[word][1][m] == p:
@@ -271,8 +418,24 @@ class Parser():
             self.homographs.pop(word)
             self.add_accent(word, p)
 
+    @journaled
+    def remove_accent(self, word):
+        if word not in self.accents: return
+        self.accents.pop(word)
+        self.changed = True
+
+    @journaled
+    def remove_word(self, word):
+        self.remove_accent(word)
+        if word in self.homographs:
+            self.homographs.pop(word)
+            self.homograph_tables.pop(word, None)
+            self.changed = True
+
 
 def parse_forms():
+    import tqdm
+
     with open(r'C:\Users\Admin\PycharmProjects\russian_g2p\russian_g2p\data\All_Forms_UTF8.txt', encoding='utf-8') as f:
         for line in tqdm.tqdm(f):
             line = line.rstrip()
@@ -369,13 +532,163 @@ def parse_hagen():
                 if re.match('^[a-яА-ЯёЁ\-\']+$', w) is None:
                     print('!!!', w)
 
+valid_word_regex = re.compile(r"[а-яА-ЯёЁ\-']+")
+number_key_regex = re.compile(r'[0-9]+')
+import_batch = 1 << 16
+
+# sources yield (word, entry) pairs: a plain accent is an int, a homograph form is a (position, morph) pair
+
+def read_forms(path):
+    # lemma#form,form,... with ' after the stressed vowel, ` marks a secondary stress
+    with open(path, encoding='utf-8') as fp:
+        for line in fp:
+            _, _, forms = line.rstrip().replace('`', '').partition('#')
+            for f in forms.split(','):
+                if 'ё' in f: continue
+                pos = f.find('\'')
+                if pos == -1: continue
+                yield f.replace('\'', ''), pos
+
+def stressed_words(words):
+    for f in words:
+        pos = f.find('+')
+        if pos == -1: continue
+        f = f.replace('+', '')
+        if 'ё' in f: continue
+        yield f, pos
+
+def stressed_forms(data):
+    for key in data:
+        for m, f in data[key].items():
+            pos = f.find('+')
+            if pos == -1: continue
+            f = f.replace('+', '')
+            if 'ё' in f: continue
+            yield f, (pos, None if number_key_regex.fullmatch(m) else m)
+
+def read_accents(path):
+    with open(path, encoding='utf-8', errors='ignore') as fp:
+        data = json.load(fp)
+    yield from stressed_words(data[1])
+    yield from stressed_forms(data[0])
+
+def read_homographs(path):
+    with open(path, encoding='utf-8', errors='ignore') as fp:
+        data = json.load(fp)
+    yield from stressed_forms(data)
+
+def batched(entries, size=import_batch):
+    batch = []
+    for e in entries:
+        batch.append(e)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+def group_entries(groups, batch, invalid, simple_words=None):
+    invalid.extend(w for w, _ in batch if valid_word_regex.fullmatch(w) is None)
+
+    for word, entry in batch:
+        entries = groups.get(word)
+        if entries is None:
+            entries = groups[word] = []
+        if simple_words is not None and isinstance(entry, int) and word in simple_words:
+            entries.append(simple_words[word])
+        entries.append(entry)
+
+# the same outcome as add_accent / add_homograph called for every entry in order
+def resolve_entries(word, accent, forms, entries):
+    for entry in entries:
+        if isinstance(entry, int):
+            if accent is not None:
+                if accent == entry: continue
+                pms = [[entry, None], [accent, None]]
+                accent = None
+            elif forms is None:
+                accent = entry
+                continue
+            else:
+                pms = [[entry, None]]
+        else:
+            pms = [entry]
+            accent = None
+
+        if forms is None:
+            forms = new_homograph(pms)
+        else:
+            for p, m in pms:
+                merge_homograph(word, forms, p, m, quiet)
+
+    return accent, forms
+
+def import_lexicon(parser, forms_path=None, accents_path=None, homographs_path=None, simple_words=None):
+    sources = [(name, reader, path) for name, reader, path in [('All_Forms', read_forms, forms_path),
+                                                              ('Accents_new', read_accents, accents_path),
+                                                              ('homographs', read_homographs, homographs_path)]
+               if path is not None]
+
+    groups = {}
+    invalid = []
+    start = time.time()
+
+    for name, reader, path in sources:
+        t = time.time()
+        count = 0
+        for batch in batched(reader(path)):
+            group_entries(groups, batch, invalid, simple_words)
+            count += len(batch)
+        t = time.time() - t
+        print(name, count, 'entries in', round(t, 1), 's,', int(count / max(t, 1e-6)), 'entries/s,',
+              round(os.path.getsize(path) / max(t, 1e-6) / (1 << 20), 1), 'MB/s')
+
+    if len(invalid) > 0:
+        print(len(invalid), 'entries with unexpected characters, e.g.', ' '.join(invalid[:10]))
+
+    t = time.time()
+    accent_changes = {}
+    stats = collections.Counter()
+    for word, entries in groups.items():
+        if count_vovels(word) < 2:
+            stats['skipped'] += 1
+            continue
+
+        old_accent = parser.accents.get(word)
+        old_forms = parser.homographs.get(word)
+        accent, forms = resolve_entries(word, old_accent, old_forms, entries)
+
+        if accent != old_accent:
+            accent_changes[word] = accent
+            if accent is not None:
+                stats['new accents' if old_accent is None else 'changed accents'] += 1
+        if forms is not None:
+            if old_forms is None: stats['new homographs'] += 1
+            parser.homographs[word] = forms
+            parser.homograph_tables.pop(word, None)
+    t = time.time() - t
+    print(len(groups), 'words resolved in', round(t, 1), 's,', int(len(groups) / max(t, 1e-6)), 'words/s')
+
+    t = time.time()
+    if isinstance(parser.accents, AccentStore):
+        parser.accents.merge(accent_changes)
+    else:
+        for word, accent in accent_changes.items():
+            if accent is None: parser.accents.pop(word, None)
+            else: parser.accents[word] = accent
+    parser.compact()
+    print('store written in', round(time.time() - t, 1), 's')
+
+    print(dict(stats), 'total', round(time.time() - start, 1), 's')
+    return stats
+
 def remove_some():
     accents = ['молча']
     homographs = [['молча', [3, '']],
                   ]
 
     for w in accents:
-        parser.accents.pop(w)
+        parser.remove_accent(w)
 
 def convert_pymorph_tag(morph):
     # if morph.tag.POS in replace_pos:
@@ -421,41 +734,37 @@ def convert_pymorph_tag(morph):
     return tag
 
 def get_homographs_from_wikt(word):
+    from wiktparser import parse_wikt_ru
+
     homographs = []
-    morphs = morpher.parse(word)
+    morphs = [compile_homograph_key(convert_pymorph_tag(m)) for m in morpher.parse(word)]
     wiki_variants = parse_wikt_ru(word)
 
-    for w, tag in wiki_variants:
-        pos = tag.split()[0]
-
-        if len(tag.split()) > 1:
-            tags = tag.split()[1]
-        else:
-            tags = ''
-
-        count = 0
-        m_tag_saved = None
+    for words, variant_tag in wiki_variants:
+        for w, tag in ((w, tag) for w in words for tag in variant_tag.ud_strings()):
+            wiki_tag = compile_homograph_key(tag)
 
-        for m in morphs:
-            m_tag = convert_pymorph_tag(m)
+            count = 0
+            m_tag_saved = None
 
-            if compare_tags(pos, tags, m_tag.split()[0], m_tag.split()[1] if len(m_tag.split()) > 1 else ''):
-                if count == 0:
-                    count += 1
-                    m_tag_saved = m_tag
-                else:
-                    if not compare_tags(m_tag_saved.split()[0], m_tag_saved.split()[1], m_tag.split()[0], m_tag.split()[1]):
+            for m_tag in morphs:
+                if compare_compiled_tags(wiki_tag, m_tag):
+                    if count == 0:
                         count += 1
+                        m_tag_saved = m_tag
+                    else:
+                        if not compare_compiled_tags(m_tag_saved, m_tag):
+                            count += 1
 
-        if count == 1:
-            acc_pos = w.find('́')
-            homographs.append([acc_pos, tag])
+            if count == 1:
+                acc_pos = w.find('́')
+                homographs.append([acc_pos, tag])
 
-        if count == 0:
-            acc_pos = w.find('́')
-            print(w, tag)
-            tag = input('wiki morph not found, enter morph: ')
-            homographs.append([acc_pos, tag])
+            if count == 0:
+                acc_pos = w.find('́')
+                print(w, tag)
+                tag = input('wiki morph not found, enter morph: ')
+                homographs.append([acc_pos, tag])
 
     return homographs
 
@@ -473,8 +782,7 @@ def add_some():
     remove = []
 
     for x in remove:
-        parser.accents.pop(x, None)
-        parser.homographs.pop(x, None)
+        parser.remove_word(x)
 
     for w in accents:
         pos = w.find('+')
@@ -485,11 +793,24 @@ def add_some():
         parser.add_homograph(w, pms)
 
 if __name__ == "__main__":
+    import argparse
+    args_parser = argparse.ArgumentParser(description='Dictionary maintenance.')
+    args_parser.add_argument('--compact', action='store_true', help='fold the change journal into new snapshots')
+    args_parser.add_argument('--forms', help='bulk import All_Forms_UTF8.txt')
+    args_parser.add_argument('--accents', help='bulk import Accents_new.json')
+    args_parser.add_argument('--homographs', help='bulk import homographs.json')
+    args = args_parser.parse_args()
+
     parser = Parser()
     parser.load()
     # add_from_wiki('дела')
     add_some()
-    # parser.accents.pop('большие', None)
-    # parser.homographs.pop('большие', None)
-    # parser.homographs2.add('порочных')
-    parser.save()
\ No newline at end of file
+    # parser.remove_word('большие')
+    # parser.add_homograph2('порочных')
+    if args.forms or args.accents or args.homographs:
+        # writes new snapshots itself
+        import_lexicon(parser, args.forms, args.accents, args.homographs)
+    elif args.compact:
+        parser.compact()
+    else:
+        parser.save()
\ No newline at end of file
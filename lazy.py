@@ -0,0 +1,67 @@
+import importlib
+import sys
+import threading
+import time
+
+import metrics
+
+# name -> seconds spent creating each resource that was used
+load_times = {}
+# two threads touching a resource for the first time create it once
+load_lock = threading.RLock()
+
+
+class Lazy():
+    # stands in for a heavy module or object until it is first used. The real value then replaces the
+    # proxy in the module global `name`, so later lookups from that module cost nothing extra
+    def __init__(self, factory, module, name):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_module', module)
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_value', None)
+
+    def _load(self):
+        value = object.__getattribute__(self, '_value')
+        if value is not None: return value
+
+        with load_lock:
+            value = object.__getattribute__(self, '_value')
+            if value is not None: return value
+
+            name = object.__getattribute__(self, '_name')
+            start = time.perf_counter()
+            value = object.__getattribute__(self, '_factory')()
+            load_times[name] = time.perf_counter() - start
+            if metrics.enabled:
+                metrics.add_duration('load ' + name, load_times[name])
+
+            object.__setattr__(self, '_value', value)
+            module = sys.modules.get(object.__getattribute__(self, '_module'))
+            if getattr(module, name, None) is self:
+                setattr(module, name, value)
+        return value
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        loaded = object.__getattribute__(self, '_value') is not None
+        return '<lazy {}{}>'.format(object.__getattribute__(self, '_name'), '' if loaded else ', not loaded')
+
+
+def lazy_import(module_name, module, name):
+    return Lazy(lambda: importlib.import_module(module_name), module, name)
+
+
+def load(value):
+    # the real object behind a proxy, anything else as it is
+    if isinstance(value, Lazy):
+        return value._load()
+    return value
+
+
+def is_loaded(value):
+    return not isinstance(value, Lazy) or object.__getattribute__(value, '_value') is not None
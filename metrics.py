@@ -0,0 +1,138 @@
+import argparse
+import atexit
+import collections
+import json
+import os
+import signal
+import time
+
+# collection is off unless enable() is called, hot paths check this flag before timing anything
+enabled = False
+export_path = None
+
+counters = collections.Counter()
+# name -> [count, total seconds, max seconds, buckets]; bucket k counts durations below 2**k microseconds
+histograms = {}
+bucket_count = 32
+
+clock = time.perf_counter
+
+
+def count(name, n=1):
+    if enabled:
+        counters[name] += n
+
+
+def observe(name, start):
+    if not enabled: return
+    add_duration(name, clock() - start)
+
+
+def add_duration(name, seconds):
+    h = histograms.get(name)
+    if h is None:
+        h = histograms[name] = [0, 0.0, 0.0, [0] * bucket_count]
+    h[0] += 1
+    h[1] += seconds
+    if seconds > h[2]: h[2] = seconds
+    h[3][min(int(seconds * 1e6).bit_length(), bucket_count - 1)] += 1
+
+
+def timed(name, iterable):
+    # time spent producing each item, e.g. sentences coming out of a generator
+    if not enabled:
+        yield from iterable
+        return
+
+    it = iter(iterable)
+    while True:
+        start = clock()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        add_duration(name, clock() - start)
+        yield item
+
+
+def take():
+    # worker processes send what they collected since the last call to the parent
+    global counters, histograms
+    data = (counters, histograms)
+    counters, histograms = collections.Counter(), {}
+    return data
+
+
+def merge(data):
+    c, hs = data
+    counters.update(c)
+    for name, (n, total, longest, buckets) in hs.items():
+        h = histograms.get(name)
+        if h is None:
+            h = histograms[name] = [0, 0.0, 0.0, [0] * bucket_count]
+        h[0] += n
+        h[1] += total
+        h[2] = max(h[2], longest)
+        h[3] = [a + b for a, b in zip(h[3], buckets)]
+
+
+def percentile(buckets, n, q):
+    # upper bound of the bucket holding the q-th duration, in microseconds
+    seen = 0
+    for k, b in enumerate(buckets):
+        seen += b
+        if seen >= q * n:
+            return 1 << k
+    return 1 << (len(buckets) - 1)
+
+
+def report():
+    return {
+        'counters': dict(counters),
+        'histograms': {name: {'count': n,
+                              'total_s': round(total, 6),
+                              'mean_us': round(total / n * 1e6, 2) if n > 0 else 0,
+                              'max_us': round(longest * 1e6, 2),
+                              'p50_us': percentile(buckets, n, 0.5),
+                              'p90_us': percentile(buckets, n, 0.9),
+                              'p99_us': percentile(buckets, n, 0.99),
+                              'buckets_us': {1 << k: b for k, b in enumerate(buckets) if b > 0}}
+                       for name, (n, total, longest, buckets) in sorted(histograms.items())},
+    }
+
+
+def export(path=None):
+    path = path or export_path
+    if path is None: return
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(report(), f, ensure_ascii=False, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def enable(path=None):
+    global enabled, export_path
+    enabled = True
+    export_path = path
+
+    if path is not None:
+        atexit.register(export)
+        # kill -USR1 <pid> writes a snapshot of a running job
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: export())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print a metrics export as a table.')
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    with open(args.path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    for name, value in sorted(data['counters'].items(), key=lambda x: -x[1]):
+        print('%-24s %10d' % (name, value))
+    print()
+    print('%-24s %10s %12s %10s %10s %10s %10s' % ('', 'count', 'total s', 'mean us', 'p50 us', 'p99 us', 'max us'))
+    for name, h in data['histograms'].items():
+        print('%-24s %10d %12.3f %10.1f %10d %10d %10.1f' % (name, h['count'], h['total_s'], h['mean_us'],
+                                                            h['p50_us'], h['p99_us'], h['max_us']))
@@ -1,16 +1,37 @@
+import argparse
+import collections
+import contextlib
+import itertools
+import multiprocessing
 import re
+import sys
+import threading
 
-import pymorphy2 as pymorphy2
+import deferred
+import metrics
+from lazy import Lazy, is_loaded, lazy_import, load
+from wikt_dump import MultistreamDump
+from dict_parser import Parser, count_vovels, get_first_vovel_pos
+from text_prepare_sentences import iter_sentences
 
-from dict_parser import Parser, count_vovels, get_first_vovel_pos, compare_tags
-from text_prepare_sentences import prepare_sentences
+# the dictionary, the models and the Wiktionary client are created on first use, splitting sentences or
+# accenting a text the dictionary covers never waits for the models
+wiktparser = lazy_import('wiktparser', __name__, 'wiktparser')
 
-acc_dict = Parser()
-acc_dict.load()
+def load_dictionary():
+    d = Parser()
+    d.load()
+    return d
 
-from wiktionaryparser import WiktionaryParser
-parser = WiktionaryParser()
-parser.set_default_language('russian')
+acc_dict = Lazy(load_dictionary, __name__, 'acc_dict')
+
+def load_wiktionary_parser():
+    from wiktionaryparser import WiktionaryParser
+    p = WiktionaryParser()
+    p.set_default_language('russian')
+    return p
+
+parser = Lazy(load_wiktionary_parser, __name__, 'parser')
 
 # import maru
 # analyzer = maru.get_analyzer(tagger='rnn', lemmatizer='pymorphy')
@@ -22,43 +43,104 @@ _stress_vowels_inv = {v: k for k, v in _stress_vowels.items()}
 
 p = re.compile('[А-Яа-яЁё' + ''.join(_stress_vowels) + '-]+')
 
-morph = pymorphy2.MorphAnalyzer()
-from rnnmorph.predictor import RNNMorphPredictor
-predictor = RNNMorphPredictor(language="ru")
+def load_morph():
+    import pymorphy2
+    return pymorphy2.MorphAnalyzer()
+
+morph = Lazy(load_morph, __name__, 'morph')
+
+def load_predictor():
+    from rnnmorph.predictor import RNNMorphPredictor
+    return RNNMorphPredictor(language="ru")
+
+predictor = Lazy(load_predictor, __name__, 'predictor')
+
+def load_accentor():
+    from russian_g2p.Accentor import Accentor
+    return Accentor(mode='many')
+
+your_accentor = Lazy(load_accentor, __name__, 'your_accentor')
 
-from russian_g2p.Accentor import Accentor
-your_accentor = Accentor(mode='many')
+# requests of accent_server run in threads: the models are not thread-safe and words learned from
+# Wiktionary are written to the dictionary and its journal
+model_lock = threading.Lock()
+dict_lock = threading.RLock()
 
 def serach_wiki(word):
-    root_text = your_accentor.load_wiki_page(word)
-    if root_text != None:
-        cur_accented_wordforms = sorted(your_accentor.get_simple_form_wiki(root_text, word))
+    root_text = wiktparser.get_wikitext(word)
+    if len(root_text) > 0:
+        with model_lock:
+            cur_accented_wordforms = sorted(your_accentor.get_simple_form_wiki(root_text, word))
         return cur_accented_wordforms
     return []
 
 
 
-def get_accent(word, words, sentence):
-    if 'ё' in word or any(s in word for s in _stress_vowels): return -1
+def has_homographs(words):
+    return any(w in acc_dict.homographs or w.lower() in acc_dict.homographs for w in words)
+
+# rnnmorph predictions by sentence tokens for one chunk; each accent_chunk has its own, so requests of
+# accent_server running at the same time never drop each other's batch
+def predict_sentences(sentences_words, batch_size=64, morph_cache=None):
+    morph_cache = {} if morph_cache is None else morph_cache
+    todo = {tuple(words) for words in sentences_words if tuple(words) not in morph_cache and has_homographs(words)}
+
+    # similar lengths in one batch keep the padding small
+    todo = sorted(todo, key=len)
+    for i in range(0, len(todo), batch_size):
+        batch = todo[i:i + batch_size]
+        with model_lock:
+            predicted = predictor.predict_sentences([list(x) for x in batch], batch_size=len(batch))
+        for words, forms in zip(batch, predicted):
+            morph_cache[words] = forms
+    return morph_cache
+
+def get_forms(words, morph_cache=None):
+    key = tuple(words)
+    if morph_cache is not None and key in morph_cache:
+        return morph_cache[key]
+
+    with model_lock:
+        forms = predictor.predict(words)
+    if morph_cache is not None:
+        morph_cache[key] = forms
+    return forms
+
+def get_accent(word, words, sentence, index=None, morph_cache=None):
+    if not metrics.enabled:
+        return find_accent(word, words, sentence, index, morph_cache)[1]
+
+    start = metrics.clock()
+    tier, pos = find_accent(word, words, sentence, index, morph_cache)
+    # counted by outcome: a tier that gives up (the accentor, homographs2 without an accent) did not resolve the word
+    metrics.counters['unresolved' if pos == -2 else tier] += 1
+    metrics.observe(tier, start)
+    return pos
+
+# (last tier tried, accent position); -1 means no accent is needed, -2 that the word was not resolved
+def find_accent(word, words, sentence, index=None, morph_cache=None):
+    if 'ё' in word or any(s in word for s in _stress_vowels): return 'vowel', -1
     vovels = count_vovels(word)
-    if vovels == 0: return -1
-    if vovels == 1: return get_first_vovel_pos(word)
+    if vovels == 0: return 'vowel', -1
+    if vovels == 1: return 'vowel', get_first_vovel_pos(word)
 
     if word in acc_dict.homographs2:
-        return acc_dict.accents.get(word, -2)
+        return 'homographs2', acc_dict.accents.get(word, -2)
 
-    if word in acc_dict.accents:
-        return acc_dict.accents[word]
+    pos = acc_dict.accents.get(word)
+    if pos is not None:
+        return 'accents', pos
 
     if word in acc_dict.homographs:
-        forms = predictor.predict(words)
+        forms = get_forms(words, morph_cache)
         # forms2 = list(analyzer.analyze(words))
 
-        index = -1
-        for i, w in enumerate(words):
-            if w == word:
-                index = i
-                break
+        if index is None:
+            index = -1
+            for i, w in enumerate(words):
+                if w == word:
+                    index = i
+                    break
 
         if index == -1:
             for i, w in enumerate(words):
@@ -73,17 +155,16 @@ def get_accent(word, words, sentence):
             print('resolved by moprhrnn, but score is too low', word, form, sentence)
             # return -1
 
-        for m in acc_dict.homographs[word][1]:
-            if compare_tags(m.split()[0], m.split()[1] if len(m.split()) > 1 else '', form.pos, form.tag):
-                pos = acc_dict.homographs[word][1][m]
-                print('resolved by moprhrnn', word, pos, sentence)
-                return pos
+        pos = acc_dict.resolve_homograph(word, form.pos, form.tag)
+        if pos is not None:
+            print('resolved by moprhrnn', word, pos, sentence)
+            return 'rnn', pos
 
         print(form, '\n', 'form2', '\n', acc_dict.homographs[word][1])
-        return -2
+        return 'rnn', -2
 
     if word[0].isupper():
-        return get_accent(word.lower(), words, sentence)
+        return find_accent(word.lower(), words, sentence, index, morph_cache)
 
     wiki_data = serach_wiki(word)
 
@@ -92,8 +173,9 @@ def get_accent(word, words, sentence):
             pos = wiki_data[0].find('+')
             print('resolved by wikidict', word, wiki_data, sentence)
 
-            acc_dict.add_accent(word, pos)
-            return pos
+            with dict_lock:
+                acc_dict.add_accent(word, pos)
+            return 'wiki', pos
         else:
             print('found by wikidict, not resolved', word, wiki_data, sentence)
 
@@ -111,45 +193,240 @@ def get_accent(word, words, sentence):
     #     print('resolved by simple_words_dawg', word, pos, sentence)
     #     return pos
 
-    pos = your_accentor.do_accents([[word]])
+    with model_lock:
+        pos = your_accentor.do_accents([[word]])
+
+    return 'accentor', -2
+
+def ask_accent(word, sentence):
+    print(word, sentence, acc_dict.homographs[word] if word in acc_dict.homographs else None)
+    print('Введите ударение:')
+    return int(input())
+
+def skip_accent(word, sentence):
+    print('not resolved', word, sentence)
+    return -1
+
+Token = collections.namedtuple('Token', ['word', 'start', 'end'])
+
+def tokenize(sentence):
+    return [Token(m.group(), m.start(), m.end()) for m in p.finditer(sentence)]
+
+def accent_words(tokens, sentence, morph_cache=None):
+    words = [t.word for t in tokens]
+    return [-1 if len(t.word) == 1 else get_accent(t.word, words, sentence, i, morph_cache) for i, t in enumerate(tokens)]
+
+def render_sentence(sentence, tokens, positions, unresolved=()):
+    parts = []
+    spans = []
+    last = 0
+    length = 0
+
+    for i, (token, pos) in enumerate(zip(tokens, positions)):
+        if i in unresolved:
+            start = length + token.start - last
+            spans.append((token.word, start, start + len(token.word)))
+        if pos == -1: continue
+
+        word = token.word
+        parts.append(sentence[last:token.start])
+        parts.append(word[:pos-1] + _stress_vowels_inv[word[pos-1]] + word[pos:])
+        length += len(parts[-2]) + len(parts[-1])
+        last = token.end
+
+    parts.append(sentence[last:])
+    return ''.join(parts), spans
+
+def chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if len(chunk) == 0: return
+        yield chunk
+
+# the word get_accent would look up in Wiktionary, None if the dictionary answers first
+def wiki_word(word):
+    if 'ё' in word or any(s in word for s in _stress_vowels): return None
+    if count_vovels(word) < 2: return None
+    if word in acc_dict.homographs2 or word in acc_dict.accents or word in acc_dict.homographs: return None
+    if word[0].isupper(): return wiki_word(word.lower())
+    return word
+
+def prefetch_wiki(words):
+    words = {wiki_word(w) for w in words if len(w) > 1} - {None}
+    if len(words) == 0: return
+    # a local dump answers fast enough one word at a time
+    if wiktparser.wiki_cache is None or wiktparser.wiki_dump is not None: return
+    wiktparser.get_wikitexts(sorted(words))
+
+def accent_chunk(chunk):
+    chunk_tokens = [tokenize(sentence) for sentence in chunk]
+
+    start = metrics.clock()
+    morph_cache = predict_sentences([[t.word for t in tokens] for tokens in chunk_tokens])
+    metrics.observe('predict', start)
+
+    start = metrics.clock()
+    prefetch_wiki(t.word for tokens in chunk_tokens for t in tokens)
+    metrics.observe('prefetch', start)
+
+    return [(tokens, accent_words(tokens, sentence, morph_cache)) for sentence, tokens in zip(chunk, chunk_tokens)]
+
+def resolve_and_render(chunk, chunk_accents, ask):
+    for sentence, (tokens, positions) in zip(chunk, chunk_accents):
+        asked = [i for i, pos in enumerate(positions) if pos == -2]
+        for i in asked:
+            positions[i] = ask(tokens[i].word, sentence)
+
+        start = metrics.clock()
+        rendered = render_sentence(sentence, tokens, positions, {i for i in asked if positions[i] == -1})
+        metrics.observe('render', start)
+        yield rendered
+
+def accent_sentences(sentences, ask=ask_accent, chunk_size=256):
+    for chunk in chunks(sentences, chunk_size):
+        yield from resolve_and_render(chunk, accent_chunk(chunk), ask)
+
+# an initializer that raises makes the pool start new workers forever, so the error waits for the first task
+init_error = None
+
+def init_worker(collect_metrics=False, offline=False, dump=None):
+    global init_error
+    try:
+        # words learned by a worker are sent back to the parent instead of its own journal
+        acc_dict.journal_path = None
+        if is_loaded(acc_dict):
+            # records a forked worker inherits are the parent's, not learned here
+            acc_dict.journal = []
+        metrics.enabled = collect_metrics
+        if offline:
+            wiktparser.wiki_cache.offline = True
+        if dump is not None:
+            wiktparser.wiki_dump = MultistreamDump(dump)
+    except Exception as e:
+        init_error = e
+
+def accent_chunk_worker(chunk):
+    if init_error is not None:
+        raise init_error
+    # each worker creates its own model on first use, one inherited from the parent would share TensorFlow's threads
+    accents = accent_chunk(chunk)
+    learned, acc_dict.journal = acc_dict.journal, []
+    return chunk, accents, learned, metrics.take() if metrics.enabled else None
+
+def pool_context():
+    # a child forked after TensorFlow has started its threads can deadlock, so once this process has
+    # created a model the workers are spawned and load everything themselves
+    if 'fork' in multiprocessing.get_all_start_methods() and not is_loaded(predictor) and not is_loaded(your_accentor):
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context('spawn')
+
+def wiki_settings():
+    # spawned workers do not see what the command line set on wiktparser
+    if not is_loaded(wiktparser): return False, None
+    offline = wiktparser.wiki_cache is not None and wiktparser.wiki_cache.offline
+    return offline, wiktparser.wiki_dump.path if wiktparser.wiki_dump is not None else None
+
+def accent_sentences_parallel(sentences, workers, ask=ask_accent, chunk_size=256):
+    context = pool_context()
+    if context.get_start_method() == 'fork':
+        # forked workers share the pages of the dictionary the parent has loaded
+        load(acc_dict)
+    if is_loaded(acc_dict):
+        # spawned workers load it from disk, with the journal
+        acc_dict.flush_journal()
+    initargs = (metrics.enabled,) + wiki_settings()
+    with context.Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+        pending = collections.deque()
+
+        def finish():
+            chunk, accents, learned, collected = pending.popleft().get()
+            acc_dict.apply_journal(learned)
+            if collected is not None:
+                metrics.merge(collected)
+            return resolve_and_render(chunk, accents, ask)
+
+        for chunk in chunks(sentences, chunk_size):
+            pending.append(pool.apply_async(accent_chunk_worker, (chunk,)))
+            # a few chunks ahead per worker, reading further would only fill memory
+            if len(pending) > 2 * workers:
+                yield from finish()
+
+        while len(pending) > 0:
+            yield from finish()
+
+def homograph_candidates(word):
+    for w in [word, word.lower()]:
+        if w in acc_dict.homographs:
+            return sorted(acc_dict.homographs[w][0])
+    return []
 
-    return -2
+def write_sentences(sentences, f, echo=False, queue=None):
+    # a terminal or a pipe gets every sentence as soon as it is ready, a regular file is buffered
+    live = not f.seekable()
+    offset = 0
+    for i, (s, unresolved) in enumerate(sentences):
+        if i > 0:
+            f.write('\n')
+            offset += 1
+        f.write(s)
+        if live:
+            f.flush()
+
+        if queue is not None:
+            for word, start, end in unresolved:
+                deferred.write_record(queue, i, offset + start, word, homograph_candidates(word), s)
+
+        offset += len(s)
+        if echo: print(s)
 
 if __name__ == "__main__":
-    fname = r'D:\syn\NMDS\1\Азимов Айзек. Движущая сила.txt'
-
-    with open(fname, encoding='utf-8') as f:
-        lines = f.readlines()
-
-    sentences = prepare_sentences(lines)
-
-    sentences_acc = []
-    for sentence in sentences:
-        words = [x for x in p.findall(sentence)]
-        sentence_acc = sentence
-
-        for word in words:
-            if len(word) == 1: continue
-            pos = get_accent(word, words, sentence)
-
-            if pos == -1: continue
-
-            if pos == -2:
-                print(word, sentence, acc_dict.homographs[word] if word in acc_dict.homographs else None)
-                print('Введите ударение:')
-                pos = int(input())
-
-            m = re.search(r'([^а-яёА-ЯЁ́]|^)(' + word + r')([^а-яёА-ЯЁ́]|$)', sentence_acc)
-            if m is None:
-                print(sentence, word)
-            sentence_acc = sentence_acc[:m.start(2)] + word[:pos-1] + _stress_vowels_inv[word[pos-1]] + word[pos:] + sentence_acc[m.end(2):]
-
-        sentences_acc.append(sentence_acc)
-        print(sentence_acc)
-
-    with open(fname.replace('.txt', '-prepared.txt'), 'w', encoding='utf-8') as f:
-        for i, s in enumerate(sentences_acc):
-            if i > 0: f.write('\n')
-            f.write(s)
-
-    acc_dict.save_if_changed()
\ No newline at end of file
+    args_parser = argparse.ArgumentParser(description='Put accents into a text.')
+    args_parser.add_argument('file', nargs='?', default='-', help='text file, - to filter stdin to stdout')
+    args_parser.add_argument('-o', '--output', help='output file, defaults to <file>-prepared.txt or stdout')
+    args_parser.add_argument('-j', '--workers', type=int, default=1, help='worker processes for accentuation')
+    args_parser.add_argument('--defer', metavar='QUEUE',
+                             help='do not ask, write unresolved words to QUEUE for deferred.py review/apply')
+    args_parser.add_argument('--dump', help='read Wiktionary pages from an indexed multistream dump (see wikt_dump.py)')
+    args_parser.add_argument('--offline', action='store_true', help='use only Wiktionary pages that are already cached')
+    args_parser.add_argument('--carry', action='store_true', help='let sentences continue on the next line of hard-wrapped text')
+    args_parser.add_argument('--metrics', metavar='JSON',
+                             help='count resolution tiers and time the stages, written at exit and on SIGUSR1')
+    args = args_parser.parse_args()
+
+    if args.metrics:
+        metrics.enable(args.metrics)
+
+    if args.offline:
+        wiktparser.wiki_cache.offline = True
+    if args.dump:
+        wiktparser.wiki_dump = MultistreamDump(args.dump)
+
+    queue = open(args.defer, 'w', encoding='utf-8') if args.defer else None
+
+    def accent(sentences, ask):
+        if args.workers > 1:
+            return accent_sentences_parallel(sentences, args.workers, ask)
+        return accent_sentences(sentences, ask)
+
+    if args.file == '-':
+        sys.stdin.reconfigure(encoding='utf-8')
+        sys.stdout.reconfigure(encoding='utf-8')
+        out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+
+        # stdin carries the text, so nobody can be asked; diagnostics go to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            write_sentences(accent(metrics.timed('split', iter_sentences(sys.stdin, carry=args.carry)), skip_accent), out, queue=queue)
+            if is_loaded(acc_dict):
+                acc_dict.save_if_changed()
+    else:
+        output = args.output or args.file.replace('.txt', '-prepared.txt')
+        with open(args.file, encoding='utf-8') as f_in, open(output, 'w', encoding='utf-8') as f:
+            sentences = metrics.timed('split', iter_sentences(f_in, carry=args.carry))
+            write_sentences(accent(sentences, skip_accent if queue else ask_accent), f, echo=True, queue=queue)
+
+        if is_loaded(acc_dict):
+            acc_dict.save_if_changed()
+
+    if queue is not None:
+        queue.close()
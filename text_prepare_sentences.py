@@ -1,5 +1,6 @@
 import argparse
 import re
+import sys
 
 replacements = {'…': '...', '—': '-', '–': '-', '―': '-', '“': '\'', '”': '\'', '"': '\'', '«': '\'', '»': '\'',
                 ' ': ' ', #No-Break Space
@@ -15,62 +16,146 @@ transliteration = {'a': 'а', 'b': 'б', 'c': 'к', 'd': 'д', 'e': 'э', 'f': '
                    'V': 'В', 'W': 'В', 'X': 'ИКС', 'Y': 'Й', 'Z': 'З',
                    }
 
+# runs of spaces and every character of both tables, replaced in one scan of the line; no value of one table is
+# a key of the other and the non-breaking space is a single character, so the order of the old passes does not matter
+normalize_table = {**replacements, **transliteration}
+normalize_regex = re.compile(' {2,}|[' + re.escape(''.join(normalize_table)) + ']')
+
+def normalize_match(m):
+    return normalize_table.get(m.group(), ' ')
+
 sentences = []
 p = re.compile(r'(?=(?:[\']|( -))?[А-Яа-яЁё0-9́́])'
                r'((?:[^!?.]|(?:[.?!\']+ - [а-яё́]))+)'
                r'(\'?[.!?]+\'?|(?=\n)|(?=$))')
 
-
-def prepare_sentences(lines, keep_dash=False, min_len=50):
-    sentences = []
+# split_sentences gives the same (dash, sentence, closing) triples as p.findall. A sentence runs up to the first
+# '.', '!' or '?' that is not followed by " - " and a lowercase letter. The body is read in one pass: text up to a
+# punctuation run, then each run that goes on after a dash with the text behind it. A run that does not go on
+# ends the match, nothing before it is tried again, so every character is looked at a bounded number of times
+# and one match covers the whole sentence, whatever the input.
+sentence_body = "[^.!?]*(?:[.!?][.!?']* - [а-яё́][^.!?]*)*"
+sentence_regex = re.compile("(?=(?:'|( -))?[А-Яа-яЁё0-9́])(" + sentence_body + ")([.!?]+'?)?")
+sentence_body_regex = re.compile(sentence_body)
+closing_regex = re.compile("[.!?]+'?")
+
+def find_sentence_end(text, i):
+    # end and closing punctuation of a sentence that is open at i, (len(text), '') when it goes on past the text
+    end = sentence_body_regex.match(text, i).end()
+    if end == len(text): return end, ''
+    return end, closing_regex.match(text, end).group()
+
+def split_sentences(text, pos=0):
+    return sentence_regex.findall(text, pos)
+
+
+def normalize_line(line, keep_dash=False):
+    line = normalize_regex.sub(normalize_match, line)
+
+    # the dashes are handled after '—' and the like became '-', the order matters: ' - - ' ends up as two spaces
+    if not keep_dash and '-' in line:
+        line = line.replace(' - ', ' ')
+        line = line.replace('- ', ' ')
+        line = line.replace(' -', ' ')
+    return line
+
+def pack_fragments(fragments, min_len=50):
+    # joins fragments with spaces until the sentence is at least min_len long, None ends a sentence early
+    parts = []
+    length = 0
+    for f in fragments:
+        if f is not None:
+            parts.append(f)
+            length += len(f) + 1
+            if length < min_len: continue
+
+        if len(parts) > 0:
+            yield ' '.join(parts)
+        parts = []
+        length = 0
+
+    if len(parts) > 0:
+        yield ' '.join(parts)
+
+def iter_fragments(lines, keep_dash=False, max_carry=2000):
+    # a hard-wrapped text continues a sentence on the next line, an empty line ends the paragraph. The open
+    # sentence is kept as its lines and only the new line is scanned for its end, so wrapped text without
+    # punctuation stays linear; past max_carry characters it is given out as it is
+    carry = []
+    carry_len = 0
+    for line in lines:
+        line = normalize_line(line, keep_dash)
+        if len(line.strip()) == 0:
+            if len(carry) > 0:
+                yield ' '.join(carry)
+                carry, carry_len = [], 0
+            yield None
+            continue
+
+        pos = 0
+        if len(carry) > 0:
+            line = line.lstrip()
+            end, closing = find_sentence_end(line, 0)
+            if closing == '':
+                carry.append(line.rstrip())
+                carry_len += len(carry[-1]) + 1
+                if carry_len > max_carry:
+                    yield ' '.join(carry)
+                    carry, carry_len = [], 0
+                continue
+
+            carry.append(line[:end])
+            yield ' '.join(carry) + closing
+            carry, carry_len = [], 0
+            pos = end + len(closing)
+
+        fragments = split_sentences(line, pos)
+        # no closing punctuation, the sentence goes on in the next line
+        if len(fragments) > 0 and fragments[-1][2] == '':
+            carry = [''.join(fragments.pop()).rstrip()]
+            carry_len = len(carry[0])
+
+        for x in fragments:
+            yield ''.join(x)
+
+    if len(carry) > 0:
+        yield ' '.join(carry)
+
+def iter_sentences(lines, keep_dash=False, min_len=50, carry=False):
+    if carry:
+        yield from pack_fragments(iter_fragments(lines, keep_dash), min_len)
+        return
+
+    # every line is split and packed on its own
     for line in lines:
         if len(line) == 0: continue
 
-        line = re.sub(' +', ' ', line)
-
-        for k in replacements:
-            line = line.replace(k, replacements[k])
-
-        if not keep_dash:
-            line = line.replace(' - ', ' ')
-            line = line.replace('- ', ' ')
-            line = line.replace(' -', ' ')
-
-        for key in transliteration:
-            line = line.replace(key, transliteration[key])
+        line = normalize_line(line, keep_dash)
 
-        s = [''.join(x) for x in p.findall(line)]
+        yield from pack_fragments([''.join(x) for x in split_sentences(line)], min_len)
 
-        new_s = []
-
-        while len(s) > 0:
-            line = ''
-            while len(line) < min_len and len(s) > 0:
-                line += s.pop(0) + ' '
-            line = line[:-1]
-
-            new_s.append(line)
-
-        sentences += new_s
-
-    return sentences
+def prepare_sentences(lines, keep_dash=False, min_len=50, carry=False):
+    return list(iter_sentences(lines, keep_dash, min_len, carry))
 
 if __name__ == "__main__":
     prepare_sentences([
                           'Над ним потеша́ются, он…     Белоголо́вый медве́дь встал на дыбы́― и попёр с рёвом:    ― Кортому…   Где Кортома?    Е. И. Замятин. Север'],
                       True)
     parser = argparse.ArgumentParser(description='Process some integers.')
-    parser.add_argument('file', metavar='F', help='file to open')
+    parser.add_argument('file', metavar='F', help='file to open, - to filter stdin to stdout')
+    parser.add_argument('--carry', action='store_true', help='let sentences continue on the next line of hard-wrapped text')
     args = parser.parse_args()
 
-    with open(args.file, encoding='utf-8') as f:
-        lines = f.readlines()
-        sentences = prepare_sentences(lines)
-
-    with open(args.file.replace('.txt', '-sentences.txt'), 'w', encoding='utf-8') as f:
-        for s in sentences:
-            f.write(s)
-            f.write('\n')
-
-    for s in sentences:
-        print(s)
+    if args.file == '-':
+        sys.stdin.reconfigure(encoding='utf-8')
+        sys.stdout.reconfigure(encoding='utf-8')
+        for s in iter_sentences(sys.stdin, carry=args.carry):
+            sys.stdout.write(s)
+            sys.stdout.write('\n')
+    else:
+        with open(args.file, encoding='utf-8') as f_in, \
+                open(args.file.replace('.txt', '-sentences.txt'), 'w', encoding='utf-8') as f:
+            for s in iter_sentences(f_in, carry=args.carry):
+                f.write(s)
+                f.write('\n')
+                print(s)
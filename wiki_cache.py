@@ -0,0 +1,123 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+
+
+class WikiCache():
+    # page wikitext by (language, title); None text marks a page that does not exist
+    def __init__(self, path=r'wiki_cache.sqlite', ttl=30 * 24 * 3600, max_entries=None, max_bytes=None, offline=False,
+                 access_batch=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.access_batch = access_batch
+
+        self.lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._writes = 0
+        # (language, title) -> last hit; access times only order eviction, so hits are written in batches
+        # with the next write instead of a commit per lookup
+        self._accessed = {}
+        atexit.register(self.flush)
+
+    def db(self):
+        # connections are not shared with forked worker processes
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                             'language TEXT, title TEXT, text TEXT, size INTEGER, fetched REAL, accessed REAL, '
+                             'PRIMARY KEY (language, title))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)')
+            self._pid = os.getpid()
+            # hits the parent saw before a fork are the parent's to write
+            self._accessed = {}
+        return self._db
+
+    def get(self, title, language='ru'):
+        with self.lock:
+            db = self.db()
+            row = db.execute('SELECT text, fetched FROM pages WHERE language = ? AND title = ?',
+                             (language, title)).fetchone()
+            if row is None:
+                return False, None
+
+            now = time.time()
+            if self.ttl is not None and not self.offline and now - row[1] > self.ttl:
+                return False, None
+
+            self._accessed[(language, title)] = now
+            if len(self._accessed) >= self.access_batch:
+                self._write_accessed(db)
+                db.commit()
+            return True, row[0]
+
+    def put(self, title, text, language='ru'):
+        with self.lock:
+            db = self.db()
+            self._write_accessed(db)
+            now = time.time()
+            db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                       (language, title, text, len(text or ''), now, now))
+            db.commit()
+
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(db)
+
+    def put_many(self, pages, language='ru'):
+        with self.lock:
+            db = self.db()
+            self._write_accessed(db)
+            now = time.time()
+            db.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                           [(language, title, text, len(text or ''), now, now) for title, text in pages.items()])
+            db.commit()
+
+            self._writes += len(pages)
+            self._evict(db)
+
+    def _write_accessed(self, db):
+        if len(self._accessed) == 0: return
+        db.executemany('UPDATE pages SET accessed = ? WHERE language = ? AND title = ?',
+                       [(t, language, title) for (language, title), t in self._accessed.items()])
+        self._accessed = {}
+
+    def flush(self):
+        with self.lock:
+            if self._db is None or self._pid != os.getpid(): return
+            self._write_accessed(self._db)
+            self._db.commit()
+
+    def _evict(self, db):
+        if self.max_entries is not None:
+            db.execute('DELETE FROM pages WHERE rowid IN (SELECT rowid FROM pages ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                       (self.max_entries,))
+
+        if self.max_bytes is not None:
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+            if total > self.max_bytes:
+                removed = 0
+                for rowid, size in db.execute('SELECT rowid, size FROM pages ORDER BY accessed').fetchall():
+                    if total - removed <= self.max_bytes: break
+                    db.execute('DELETE FROM pages WHERE rowid = ?', (rowid,))
+                    removed += size
+
+        if self.ttl is not None and not self.offline:
+            db.execute('DELETE FROM pages WHERE fetched < ?', (time.time() - self.ttl,))
+
+        db.commit()
+
+    def close(self):
+        with self.lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._write_accessed(self._db)
+                self._db.commit()
+                self._db.close()
+            self._db = None
@@ -0,0 +1,154 @@
+import argparse
+import bz2
+import collections
+import os
+import re
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+page_regex = re.compile(rb'<page>.*?</page>', re.S)
+
+
+def iter_streams(path, start=0, block=1 << 20):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        offset = start
+        buf = b''
+
+        while True:
+            d = bz2.BZ2Decompressor()
+            out = []
+            consumed = 0
+
+            while not d.eof:
+                if len(buf) == 0:
+                    buf = f.read(block)
+                    if len(buf) == 0:
+                        if consumed > 0: raise EOFError('dump ends inside a bz2 stream', offset)
+                        return
+                out.append(d.decompress(buf))
+                if d.eof:
+                    consumed += len(buf) - len(d.unused_data)
+                    buf = d.unused_data
+                else:
+                    consumed += len(buf)
+                    buf = b''
+
+            yield offset, b''.join(out)
+            offset += consumed
+
+
+def parse_pages(data):
+    pages = []
+    for m in page_regex.finditer(data):
+        page = ElementTree.fromstring(m.group())
+        redirect = page.find('redirect')
+        pages.append({
+            'title': page.findtext('title'),
+            'ns': int(page.findtext('ns', '0')),
+            'id': int(page.findtext('id')),
+            'redirect': redirect.get('title') if redirect is not None else None,
+            'text': page.findtext('revision/text') or '',
+        })
+    return pages
+
+
+def iter_pages(path, start=0):
+    for offset, data in iter_streams(path, start):
+        yield offset, parse_pages(data)
+
+
+class MultistreamDump():
+    # random access to ruwiktionary-*-pages-articles-multistream.xml.bz2 through a title index
+    def __init__(self, path, index_path=None, cached_streams=8):
+        self.path = path
+        self.index_path = index_path or path + '.index.sqlite'
+        self.cached_streams = cached_streams
+        self._streams = collections.OrderedDict()
+        self._db = None
+        # accent_server handler threads share the stream cache and the connection
+        self.lock = threading.RLock()
+
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.index_path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS titles (title TEXT PRIMARY KEY, offset INTEGER, id INTEGER)')
+        return self._db
+
+    def build_index(self, wikimedia_index=None):
+        db = self.db()
+        db.execute('DELETE FROM titles')
+        t = time.time()
+
+        if wikimedia_index is not None:
+            # offset:page_id:title lines shipped next to the dump
+            with bz2.open(wikimedia_index, 'rt', encoding='utf-8') as f:
+                rows = (line.rstrip('\n').split(':', 2) for line in f)
+                db.executemany('INSERT OR REPLACE INTO titles VALUES (?, ?, ?)',
+                               ((title, int(offset), int(page_id)) for offset, page_id, title in rows))
+        else:
+            for offset, pages in iter_pages(self.path):
+                db.executemany('INSERT OR REPLACE INTO titles VALUES (?, ?, ?)',
+                               ((p['title'], offset, p['id']) for p in pages))
+
+        db.commit()
+        count = db.execute('SELECT COUNT(*) FROM titles').fetchone()[0]
+        print(count, 'titles indexed in', round(time.time() - t, 1), 's')
+        return count
+
+    def stream(self, offset):
+        with self.lock:
+            if offset in self._streams:
+                self._streams.move_to_end(offset)
+                return self._streams[offset]
+
+            _, data = next(iter_streams(self.path, offset))
+            pages = {p['title']: p for p in parse_pages(data)}
+
+            self._streams[offset] = pages
+            if len(self._streams) > self.cached_streams:
+                self._streams.popitem(last=False)
+            return pages
+
+    def get_page(self, title):
+        with self.lock:
+            row = self.db().execute('SELECT offset FROM titles WHERE title = ?', (title,)).fetchone()
+            if row is None: return None
+            return self.stream(row[0]).get(title)
+
+    def get_wikitext(self, title):
+        seen = set()
+        while title not in seen:
+            seen.add(title)
+            page = self.get_page(title)
+            if page is None: return None
+            if page['redirect'] is None: return page['text']
+            title = page['redirect']
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline Wiktionary pages from a multistream dump.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('index', help='build the title index')
+    p.add_argument('dump')
+    p.add_argument('--wikimedia-index', help='the -multistream-index.txt.bz2 file, otherwise the dump is scanned')
+
+    p = subparsers.add_parser('get', help='print page wikitext')
+    p.add_argument('dump')
+    p.add_argument('title')
+
+    args = parser.parse_args()
+
+    dump = MultistreamDump(args.dump)
+    if args.command == 'index':
+        if args.wikimedia_index is None and os.path.exists(args.dump.replace('.xml.bz2', '-index.txt.bz2')):
+            args.wikimedia_index = args.dump.replace('.xml.bz2', '-index.txt.bz2')
+        dump.build_index(args.wikimedia_index)
+    if args.command == 'get':
+        t = time.time()
+        print(dump.get_wikitext(args.title))
+        print(round((time.time() - t) * 1000, 1), 'ms')
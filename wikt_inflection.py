@@ -0,0 +1,377 @@
+import argparse
+import json
+import re
+import sys
+
+# local replacement for the expandtemplates API on the regular paradigms of
+# 'сущ ru' / 'сущ-ru' (Zaliznyak types 1-8, stress a-f); anything else returns None and goes to the API.
+# 'прил ru' (1a, 3a, 4a) tables are built without the short forms, which need fleeting vowels (кра́сен)
+# and the template arguments that say an adjective has none (деревя́нный), so expand leaves them to the
+# API as well; the benchmarks use them as fixtures. 'гл ru' is not generated
+
+stress_mark = '́'
+vowels = set('аеёиоуыэюяАЕЁИОУЫЭЮЯ')
+sibilants = set('жшчщ')
+
+cases = ['nom', 'gen', 'dat', 'acc', 'ins', 'loc']
+case_names = {
+    'nom': 'именительный',
+    'gen': 'родительный',
+    'dat': 'дательный',
+    'acc': 'винительный',
+    'ins': 'творительный',
+    'loc': 'предложный',
+}
+case_abbr = {
+    'nom': 'Им.',
+    'gen': 'Р.',
+    'dat': 'Д.',
+    'acc': 'В.',
+    'ins': 'Тв.',
+    'loc': 'Пр.',
+}
+genders = {
+    'm': 'm',
+    'f': 'f',
+    'n': 'n',
+    'м': 'm',
+    'ж': 'f',
+    'с': 'n',
+}
+animacy = {
+    'a': True,
+    'ina': False,
+}
+
+# slot: ending, or (unstressed, stressed) where the spelling depends on stress;
+# masculine and plural accusatives are taken from nom/gen by animacy
+noun_endings = {
+    ('m', '1'): {'nom_sg': '', 'gen_sg': 'а', 'dat_sg': 'у', 'ins_sg': 'ом', 'loc_sg': 'е',
+                 'nom_pl': 'ы', 'gen_pl': 'ов', 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('m', '2'): {'nom_sg': 'ь', 'gen_sg': 'я', 'dat_sg': 'ю', 'ins_sg': ('ем', 'ём'), 'loc_sg': 'е',
+                 'nom_pl': 'и', 'gen_pl': 'ей', 'dat_pl': 'ям', 'ins_pl': 'ями', 'loc_pl': 'ях'},
+    ('m', '3'): {'nom_sg': '', 'gen_sg': 'а', 'dat_sg': 'у', 'ins_sg': 'ом', 'loc_sg': 'е',
+                 'nom_pl': 'и', 'gen_pl': 'ов', 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('m', '4'): {'nom_sg': '', 'gen_sg': 'а', 'dat_sg': 'у', 'ins_sg': ('ем', 'ом'), 'loc_sg': 'е',
+                 'nom_pl': 'и', 'gen_pl': 'ей', 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('m', '5'): {'nom_sg': '', 'gen_sg': 'а', 'dat_sg': 'у', 'ins_sg': ('ем', 'ом'), 'loc_sg': 'е',
+                 'nom_pl': 'ы', 'gen_pl': ('ев', 'ов'), 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('m', '6'): {'nom_sg': 'й', 'gen_sg': 'я', 'dat_sg': 'ю', 'ins_sg': ('ем', 'ём'), 'loc_sg': 'е',
+                 'nom_pl': 'и', 'gen_pl': ('ев', 'ёв'), 'dat_pl': 'ям', 'ins_pl': 'ями', 'loc_pl': 'ях'},
+    ('m', '7'): {'nom_sg': 'ий', 'gen_sg': 'ия', 'dat_sg': 'ию', 'ins_sg': 'ием', 'loc_sg': 'ии',
+                 'nom_pl': 'ии', 'gen_pl': 'иев', 'dat_pl': 'иям', 'ins_pl': 'иями', 'loc_pl': 'иях'},
+    ('f', '1'): {'nom_sg': 'а', 'gen_sg': 'ы', 'dat_sg': 'е', 'acc_sg': 'у', 'ins_sg': 'ой', 'loc_sg': 'е',
+                 'nom_pl': 'ы', 'gen_pl': '', 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('f', '2'): {'nom_sg': 'я', 'gen_sg': 'и', 'dat_sg': 'е', 'acc_sg': 'ю', 'ins_sg': ('ей', 'ёй'), 'loc_sg': 'е',
+                 'nom_pl': 'и', 'gen_pl': ('ь', 'ей'), 'dat_pl': 'ям', 'ins_pl': 'ями', 'loc_pl': 'ях'},
+    ('f', '3'): {'nom_sg': 'а', 'gen_sg': 'и', 'dat_sg': 'е', 'acc_sg': 'у', 'ins_sg': 'ой', 'loc_sg': 'е',
+                 'nom_pl': 'и', 'gen_pl': '', 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('f', '4'): {'nom_sg': 'а', 'gen_sg': 'и', 'dat_sg': 'е', 'acc_sg': 'у', 'ins_sg': ('ей', 'ой'), 'loc_sg': 'е',
+                 'nom_pl': 'и', 'gen_pl': '', 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('f', '5'): {'nom_sg': 'а', 'gen_sg': 'ы', 'dat_sg': 'е', 'acc_sg': 'у', 'ins_sg': ('ей', 'ой'), 'loc_sg': 'е',
+                 'nom_pl': 'ы', 'gen_pl': '', 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('f', '6'): {'nom_sg': 'я', 'gen_sg': 'и', 'dat_sg': 'е', 'acc_sg': 'ю', 'ins_sg': ('ей', 'ёй'), 'loc_sg': 'е',
+                 'nom_pl': 'и', 'gen_pl': 'й', 'dat_pl': 'ям', 'ins_pl': 'ями', 'loc_pl': 'ях'},
+    ('f', '7'): {'nom_sg': 'ия', 'gen_sg': 'ии', 'dat_sg': 'ии', 'acc_sg': 'ию', 'ins_sg': 'ией', 'loc_sg': 'ии',
+                 'nom_pl': 'ии', 'gen_pl': 'ий', 'dat_pl': 'иям', 'ins_pl': 'иями', 'loc_pl': 'иях'},
+    ('f', '8'): {'nom_sg': 'ь', 'gen_sg': 'и', 'dat_sg': 'и', 'acc_sg': 'ь', 'ins_sg': 'ью', 'loc_sg': 'и',
+                 'nom_pl': 'и', 'gen_pl': 'ей', 'dat_pl': 'ям', 'ins_pl': 'ями', 'loc_pl': 'ях'},
+    ('n', '1'): {'nom_sg': 'о', 'gen_sg': 'а', 'dat_sg': 'у', 'ins_sg': 'ом', 'loc_sg': 'е',
+                 'nom_pl': 'а', 'gen_pl': '', 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('n', '2'): {'nom_sg': ('е', 'ё'), 'gen_sg': 'я', 'dat_sg': 'ю', 'ins_sg': ('ем', 'ём'), 'loc_sg': 'е',
+                 'nom_pl': 'я', 'gen_pl': 'ей', 'dat_pl': 'ям', 'ins_pl': 'ями', 'loc_pl': 'ях'},
+    ('n', '4'): {'nom_sg': ('е', 'о'), 'gen_sg': 'а', 'dat_sg': 'у', 'ins_sg': ('ем', 'ом'), 'loc_sg': 'е',
+                 'nom_pl': 'а', 'gen_pl': '', 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('n', '5'): {'nom_sg': ('е', 'о'), 'gen_sg': 'а', 'dat_sg': 'у', 'ins_sg': ('ем', 'ом'), 'loc_sg': 'е',
+                 'nom_pl': 'а', 'gen_pl': '', 'dat_pl': 'ам', 'ins_pl': 'ами', 'loc_pl': 'ах'},
+    ('n', '7'): {'nom_sg': 'ие', 'gen_sg': 'ия', 'dat_sg': 'ию', 'ins_sg': 'ием', 'loc_sg': 'ии',
+                 'nom_pl': 'ия', 'gen_pl': 'ий', 'dat_pl': 'иям', 'ins_pl': 'иями', 'loc_pl': 'иях'},
+}
+
+# slots with the stress on the ending for each stress scheme
+ending_stressed = {
+    'a': set(),
+    'b': {'sg', 'pl', 'nom_pl'},
+    'c': {'pl', 'nom_pl'},
+    'd': {'sg'},
+    'e': {'pl'},
+    'f': {'sg', 'pl'},
+}
+
+adjective_endings = {
+    # m, n, f, pl for nom, gen, dat, ins, loc
+    '1': {'nom': ('ый', 'ое', 'ая', 'ые'), 'gen': ('ого', 'ого', 'ой', 'ых'), 'dat': ('ому', 'ому', 'ой', 'ым'),
+          'ins': ('ым', 'ым', 'ой', 'ыми'), 'loc': ('ом', 'ом', 'ой', 'ых'), 'acc_f': 'ую'},
+    '3': {'nom': ('ий', 'ое', 'ая', 'ие'), 'gen': ('ого', 'ого', 'ой', 'их'), 'dat': ('ому', 'ому', 'ой', 'им'),
+          'ins': ('им', 'им', 'ой', 'ими'), 'loc': ('ом', 'ом', 'ой', 'их'), 'acc_f': 'ую'},
+    '4': {'nom': ('ий', 'ее', 'ая', 'ие'), 'gen': ('его', 'его', 'ей', 'их'), 'dat': ('ему', 'ему', 'ей', 'им'),
+          'ins': ('им', 'им', 'ей', 'ими'), 'loc': ('ем', 'ем', 'ей', 'их'), 'acc_f': 'ую'},
+}
+velars = set('гкх')
+
+noun_index_regex = re.compile(r'([1-8])([a-f])')
+adjective_index_regex = re.compile(r'([134])a')
+
+
+def unstress(word):
+    return word.replace(stress_mark, '')
+
+
+def stress_position(word):
+    # index of the stressed vowel in the unstressed word
+    i = word.find(stress_mark)
+    if i > 0: return i - 1
+    i = word.find('ё')
+    if i >= 0: return i
+    return None
+
+
+def vowel_positions(s):
+    return [i for i, c in enumerate(s) if c in vowels]
+
+
+def put_stress(word, i):
+    if word[i] in 'ёЁ': return word
+    return word[:i + 1] + stress_mark + word[i + 1:]
+
+
+def make_form(stem, stem_stress, ending, on_ending):
+    if isinstance(ending, tuple):
+        ending = ending[1] if on_ending else ending[0]
+
+    word = stem + ending
+    if on_ending:
+        stressed = vowel_positions(ending)
+        i = len(stem) + stressed[0] if len(stressed) > 0 else vowel_positions(stem)[-1]
+    else:
+        i = stem_stress
+    return put_stress(word, i)
+
+
+def noun_paradigm(headword, gender, animate, index, stem_argument=None):
+    m = noun_index_regex.fullmatch(index)
+    if m is None: return None
+    declension, scheme = m.groups()
+
+    endings = noun_endings.get((gender, declension))
+    if endings is None: return None
+    if declension == '7' and scheme != 'a': return None
+
+    word = unstress(headword)
+    nom_sg = endings['nom_sg']
+    nom_sg_on_ending = 'sg' in ending_stressed[scheme]
+    if isinstance(nom_sg, tuple): nom_sg = nom_sg[1] if nom_sg_on_ending else nom_sg[0]
+
+    if not word.endswith(nom_sg): return None
+    stem = word[:len(word) - len(nom_sg)]
+    if stem_argument is not None and unstress(stem_argument) != stem: return None
+
+    stem_vowels = vowel_positions(stem)
+    if len(stem_vowels) == 0: return None
+    # unstressed ё turns into е, the stem stays as written only with fixed stress
+    if 'ё' in stem and scheme != 'a': return None
+    if declension == '8' and stem[-1] in sibilants:
+        endings = dict(endings, dat_pl='ам', ins_pl='ами', loc_pl='ах')
+    if declension in ('3', '4', '5') and stem[-1] not in {'3': velars, '4': sibilants, '5': 'ц'}[declension]:
+        return None
+
+    accented = stress_position(headword)
+    if accented is None:
+        if len(vowel_positions(word)) != 1: return None
+        accented = vowel_positions(word)[0]
+
+    has_ending_vowel = len(vowel_positions(nom_sg)) > 0
+    if accented >= len(stem):
+        # stress on the ending in the headword
+        if not nom_sg_on_ending: return None
+        stem_stress = stem_vowels[-1]
+        if len(stem_vowels) > 1 and scheme in ('d', 'f'): return None
+    else:
+        if nom_sg_on_ending and has_ending_vowel: return None
+        if nom_sg_on_ending and accented != stem_vowels[-1]: return None
+        stem_stress = accented
+
+    forms = {}
+    for number in ('sg', 'pl'):
+        for case in cases:
+            slot = case + '_' + number
+            if slot not in endings: continue
+            on_ending = number in ending_stressed[scheme]
+            if slot == 'nom_pl': on_ending = 'nom_pl' in ending_stressed[scheme]
+            forms[slot] = make_form(stem, stem_stress, endings[slot], on_ending)
+
+    if 'acc_sg' not in forms:
+        forms['acc_sg'] = forms['gen_sg'] if animate and gender == 'm' else forms['nom_sg']
+    forms['acc_pl'] = forms['gen_pl'] if animate else forms['nom_pl']
+    return forms
+
+
+def noun_table(forms):
+    lines = ['{| class="morfotable ru"',
+             '! [[падеж]]',
+             '! [[единственное число|ед. ч.]]',
+             '! [[множественное число|мн. ч.]]']
+    for case in cases:
+        lines.append('|-')
+        lines.append('! [[{}]]'.format(case_names[case]))
+        lines.append('| ' + forms[case + '_sg'])
+        lines.append('| ' + forms[case + '_pl'])
+    lines.append('|}')
+    return '\n'.join(lines)
+
+
+def adjective_paradigm(headword, index, stem_argument=None):
+    m = adjective_index_regex.fullmatch(index)
+    if m is None: return None
+    endings = adjective_endings[m.group(1)]
+
+    word = unstress(headword)
+    if not word.endswith(endings['nom'][0]): return None
+    stem = word[:-2]
+    if stem_argument is not None and unstress(stem_argument) != stem: return None
+    if m.group(1) == '3' and stem[-1] not in velars: return None
+    if m.group(1) == '4' and stem[-1] not in sibilants: return None
+
+    stem_stress = stress_position(headword)
+    if stem_stress is None:
+        if len(vowel_positions(stem)) != 1: return None
+        stem_stress = vowel_positions(stem)[0]
+    if stem_stress >= len(stem): return None
+
+    def form(ending):
+        return put_stress(stem + ending, stem_stress)
+
+    forms = {case: [form(e) for e in endings[case]] for case in ('nom', 'gen', 'dat', 'ins', 'loc')}
+    forms['acc_anim'] = [forms['gen'][0], forms['nom'][1], form(endings['acc_f']), forms['gen'][3]]
+    forms['acc_inan'] = [forms['nom'][0], forms['nom'][1], form(endings['acc_f']), forms['nom'][3]]
+    return forms
+
+
+def adjective_table(forms):
+    def cells(values, skip=()):
+        return ''.join('<td>{}</td>'.format(v) for i, v in enumerate(values) if i not in skip)
+
+    rows = ['<table class="morfotable ru">',
+            '<tr><th colspan="2" rowspan="2">[[падеж]]</th><th colspan="3">[[единственное число|ед. ч.]]</th>'
+            '<th rowspan="2">[[множественное число|мн. ч.]]</th></tr>',
+            '<tr><th>[[мужской род|муж. р.]]</th><th>[[средний род|ср. р.]]</th><th>[[женский род|жен. р.]]</th></tr>']
+    for case in cases:
+        label = '[[{}|{}]]'.format(case_names[case], case_abbr[case])
+        if case == 'acc':
+            values = forms['acc_anim']
+            rows.append('<tr><th rowspan="2">{}</th><th>[[одушевлённый|одуш.]]</th><td>{}</td>'
+                        '<td rowspan="2">{}</td><td rowspan="2">{}</td><td>{}</td></tr>'.format(label, *values))
+            values = forms['acc_inan']
+            rows.append('<tr><th>[[неодушевлённый|неод.]]</th>' + cells(values, skip=(1, 2)) + '</tr>')
+            continue
+        rows.append('<tr><th colspan="2">{}</th>'.format(label) + cells(forms[case]) + '</tr>')
+    rows.append('</table>')
+    return '\n'.join(rows)
+
+
+def expand(template_name, headword, arguments=None):
+    # wikitext in the shape of the expandtemplates output, or None when not supported
+    arguments = arguments or {}
+    if headword is None or len(headword) == 0: return None
+    stem = arguments.get('основа')
+
+    if template_name == 'сущ-ru':
+        index = arguments.get('индекс') or arguments.get('2')
+        if index is None: return None
+        data = index.split()
+    elif template_name.startswith('сущ ru '):
+        data = template_name.split()[2:]
+    else:
+        return None
+
+    if len(data) != 3: return None
+    gender, anim, index = data
+    if gender not in genders or anim not in animacy: return None
+
+    forms = noun_paradigm(headword, genders[gender], animacy[anim], index, stem)
+    return noun_table(forms) if forms is not None else None
+
+
+def table_cells(text):
+    # form cells of a noun expansion, the way parse_template reads them
+    import wikitextparser as wtp
+    from wikt_template_parser import cell_words
+
+    table = wtp.parse(text).tables[0].data()[1:]
+    return [[cell_words(c) for c in row[1:3]] for row in table]
+
+
+def record(titles_path, out_path):
+    import wikitextparser as wtp
+    from wiktparser import get_wikitexts, template_headword, get_wikitext_api_expandtemplates
+
+    with open(titles_path, encoding='utf-8') as f:
+        titles = [line.strip() for line in f if len(line.strip()) > 0]
+
+    records = []
+    for title, text in get_wikitexts(titles).items():
+        if not text: continue
+        for template in wtp.parse(text).templates:
+            name = template.name.strip()
+            if not any(name.startswith(t) for t in ('сущ ru ', 'сущ-ru', 'прил ru ', 'гл ru ')): continue
+            records.append({'title': title, 'template': template.string, 'headword': template_headword(template),
+                            'expansion': get_wikitext_api_expandtemplates(template.string)})
+
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=1)
+    print(len(records), 'expansions recorded')
+
+
+def check(recorded_path, verbose=False):
+    import wikitextparser as wtp
+    from wiktparser import template_arguments
+
+    with open(recorded_path, encoding='utf-8') as f:
+        records = json.load(f)
+
+    stats = {'same': 0, 'different': 0, 'unsupported': 0}
+    for r in records:
+        template = wtp.parse(r['template']).templates[0]
+        name = template.name.strip()
+        local = expand(name, r['headword'], template_arguments(template))
+        if local is None:
+            stats['unsupported'] += 1
+            continue
+
+        expected, got = table_cells(r['expansion']), table_cells(local)
+        if expected == got:
+            stats['same'] += 1
+        else:
+            stats['different'] += 1
+            if verbose: print(r['title'], name, expected, got, sep='\n    ')
+
+    print(stats)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local expansion of Wiktionary inflection templates.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('expand', help='print the local expansion')
+    p.add_argument('template')
+    p.add_argument('headword')
+
+    p = subparsers.add_parser('record', help='store API expansions of the inflection templates on the pages')
+    p.add_argument('titles')
+    p.add_argument('out')
+
+    p = subparsers.add_parser('check', help='compare the local expansions with recorded API ones')
+    p.add_argument('recorded')
+    p.add_argument('-v', '--verbose', action='store_true')
+
+    args = parser.parse_args()
+
+    if args.command == 'expand':
+        print(expand(args.template, args.headword))
+    if args.command == 'record':
+        record(args.titles, args.out)
+    if args.command == 'check':
+        stats = check(args.recorded, args.verbose)
+        if stats['different'] > 0 or stats['same'] == 0:
+            sys.exit(1)
@@ -1,68 +1,57 @@
-import copy
+import functools
 import re
+from collections import namedtuple
 
 import wikitextparser as wtp
-from bs4 import BeautifulSoup
+from lxml import etree
 
 from itertools import product
 
 split_regex = r'\n| |<br\/>|<br \/>'
 
-def table_to_2d(table_tag):
-    rowspans = []  # track pending rowspans
-    rows = table_tag.find_all('tr')
+def html_table(text):
+    # first <table> of an expansion, same tree as BeautifulSoup(text, 'lxml').table
+    root = etree.HTML(text.replace('<br>', '\n'))
+    return root.find('.//table') if root is not None else None
 
-    # first scan, see how many columns we need
+def table_to_2d(table):
+    # the only walk over the tree; spans are then laid out from plain tuples
+    rows = [[(c.get('rowspan', 1), c.get('colspan', 1), ''.join(c.itertext())) for c in tr if c.tag in ('td', 'th')]
+            for tr in table.iter('tr')]
+
+    # count columns (including spanned) and add active rowspans from preceding rows;
+    # the last cell is counted as width 1 so that an extended colspan does not create
+    # phantom columns, and a colspan of 0 ("fill until the end") only counts as 1
     colcount = 0
-    for r, row in enumerate(rows):
-        cells = row.find_all(['td', 'th'], recursive=False)
-        # count columns (including spanned).
-        # add active rowspans from preceding rows
-        # we *ignore* the colspan value on the last cell, to prevent
-        # creating 'phantom' columns with no actual cells, only extended
-        # colspans. This is achieved by hardcoding the last cell width as 1.
-        # a colspan of 0 means “fill until the end” but can really only apply
-        # to the last cell; ignore it elsewhere.
+    rowspans = []
+    for r, cells in enumerate(rows):
         colcount = max(
             colcount,
-            sum(int(c.get('colspan', 1)) or 1 for c in cells[:-1]) + len(cells[-1:]) + len(rowspans))
-        # update rowspan bookkeeping; 0 is a span to the bottom.
-        rowspans += [int(c.get('rowspan', 1)) or len(rows) - r for c in cells]
+            sum(int(c[1]) or 1 for c in cells[:-1]) + len(cells[-1:]) + len(rowspans))
+        # rowspan 0 is a span to the bottom
+        rowspans += [int(c[0]) or len(rows) - r for c in cells]
         rowspans = [s - 1 for s in rowspans if s > 1]
 
-    # it doesn't matter if there are still rowspan numbers 'active'; no extra
-    # rows to show in the table means the larger than 1 rowspan numbers in the
-    # last table row are ignored.
-
-    # build an empty matrix for all possible cells
     table = [[None] * colcount for row in rows]
 
-    # fill matrix from row data
-    rowspans = {}  # track pending rowspans, column number mapping to count
-    for row, row_elem in enumerate(rows):
+    rowspans = {}  # pending rowspans, column number mapping to count
+    for row, cells in enumerate(rows):
         span_offset = 0  # how many columns are skipped due to row and colspans
-        for col, cell in enumerate(row_elem.find_all(['td', 'th'], recursive=False)):
-            # adjust for preceding row and colspans
+        for col, (rowspan, colspan, value) in enumerate(cells):
             col += span_offset
             while rowspans.get(col, 0):
                 span_offset += 1
                 col += 1
 
-            # fill table data
-            rowspan = rowspans[col] = int(cell.get('rowspan', 1)) or len(rows) - row
-            colspan = int(cell.get('colspan', 1)) or colcount - col
-            # next column is offset by the colspan
+            rowspan = rowspans[col] = int(rowspan) or len(rows) - row
+            colspan = int(colspan) or colcount - col
             span_offset += colspan - 1
-            value = cell.get_text()
             for drow, dcol in product(range(rowspan), range(colspan)):
-                try:
-                    table[row + drow][col + dcol] = value
-                    rowspans[col + dcol] = rowspan
-                except IndexError:
-                    # rowspan or colspan outside the confines of the table
-                    pass
-
-        # update rowspan bookkeeping
+                # spans outside the confines of the table are cut
+                if row + drow >= len(rows) or col + dcol >= colcount: continue
+                table[row + drow][col + dcol] = value
+                rowspans[col + dcol] = rowspan
+
         rowspans = {c: s - 1 for c, s in rowspans.items() if s > 1}
 
     return table
@@ -177,505 +166,444 @@ r_degree_univarsalD = {
     'качественное': 'Pos',
 }
 
-known_templates = ['Форма-сущ', 'Форма-гл', 'conj ru', 'сущ-ru']
-advansed_templates = ['сущ ru', 'прил ru', 'Фам ru', 'гл ru']
+# handlers by exact template name, and by family ('сущ ru' for 'сущ ru m ina 1a')
+template_handlers = {}
+template_families = {}
 
-def known_template(template):
-    template_name = template.name.strip()
-    if template_name in known_templates:
-        return True
+def template_handler(*names, family=False):
+    def register(handler):
+        for name in names:
+            (template_families if family else template_handlers)[name] = handler
+        find_handler.cache_clear()
+        return handler
+    return register
 
-    for i in advansed_templates:
-        if i in template_name:
-            return True
-    return False
+@functools.lru_cache(maxsize=None)
+def find_handler(template_name):
+    handler = template_handlers.get(template_name)
+    if handler is not None: return handler
+
+    handler = template_families.get(' '.join(template_name.split()[:2]))
+    if handler is not None: return handler
+
+    # a family name anywhere in the template name, the way they used to be matched
+    for name, handler in template_families.items():
+        if name in template_name:
+            return handler
+    return None
+
+def known_template(template):
+    return find_handler(template.name.strip()) is not None
 
 def get_name_value(argument):
     name = argument.name.strip()
     value = argument.value.strip()
     return name, value if len(value) > 0 else None
 
-def parse_template(word_acc, template):
-    from wiktparser import search_section_for_template, get_word_from_slogi, get_wikitext_api_expandtemplates
-
-    variants = []
-    template_name = template.name.strip()
-
-    opencorpora_tag = {'tag': {}}
-    universalD_tag = {'tag': {}}
-
-    if template_name == 'Форма-сущ':
-        opencorpora_tag['pos'] = 'NOUN'
-        universalD_tag['pos'] = 'NOUN'
-
-        for argument in template.arguments:
-            name, value = get_name_value(argument)
-
-            if name in ['база', '1'] and value is not None:
-                opencorpora_tag['base'] = value
-                universalD_tag['base'] = value
-                continue
-
-            if name in ['падеж', '2'] and value is not None:
-                if value in ['ив', 'рв', 'рдп']:
-                    opencorpora_tag['tag']['Case'] = []
-                    universalD_tag['tag']['Case'] = []
-                    for v in value:
-                        opencorpora_tag['tag']['Case'].append(r_case_opencorpora.get(v))
-                        universalD_tag['tag']['Case'].append(r_case_universalD.get(v))
-                    continue
-
-                if ' и ' in value:
-                    opencorpora_tag['tag']['Case'] = []
-                    universalD_tag['tag']['Case'] = []
-                    for v in value.split(' и '):
-                        opencorpora_tag['tag']['Case'].append(r_case_opencorpora.get(v))
-                        universalD_tag['tag']['Case'].append(r_case_universalD.get(v))
-                    continue
-
-                opencorpora_tag['tag']['Case'] = r_case_opencorpora.get(value)
-                universalD_tag['tag']['Case'] = r_case_universalD.get(value)
-                continue
-
-            if name in ['число', '3'] and value is not None:
-                opencorpora_tag['tag']['Number'] = r_number[value]
-                universalD_tag['tag']['Number'] = r_number[value]
-                continue
-
-            if name in ['помета', '5']:
-                continue
-
-            if name == 'число' and value is not None:
-                opencorpora_tag['tag']['Number'] = r_number[value]
-                universalD_tag['tag']['Number'] = r_number[value]
-                continue
-
-            if name == 'слоги':
-                continue
-
-        return [[word_acc, opencorpora_tag, universalD_tag]]
+word_regex = re.compile(r'([́а-яёА-ЯЁ]+)')
+tagged_word_regex = re.compile(r'>([́а-яёА-ЯЁ]+)<')
+split_pattern = re.compile(split_regex)
 
-    if template_name == 'Форма-гл':
-        opencorpora_tag['pos'] = 'VERB'
-        universalD_tag['pos'] = 'VERB'
+def cell_words(cell):
+    m = word_regex.fullmatch(cell)
+    if m is None: m = tagged_word_regex.search(cell)
+    if m is not None: return [m.group(1)]
 
-        for argument in template.arguments:
-            name, value = get_name_value(argument)
+    if '—' in cell: return None
 
-            if name in ['база', '1'] and value is not None:
-                opencorpora_tag['base'] = value
-                universalD_tag['base'] = value
-                continue
+    splits = split_pattern.split(cell)
+    if len(splits) > 1: return splits
+    raise Exception
 
-            if name in ['время', '2']:
-                if value is None: continue
-                opencorpora_tag['tag']['Tense'] = r_tense_opencorpora.get(value)
-                universalD_tag['tag']['Tense'] = r_tense_universalD.get(value)
-                continue
+# with_feature argument default, never stored in a tag
+missing = object()
 
-            if name == 'залог':
-                continue
 
-            if name in ['род', '3']:
-                if value is None: continue
-                opencorpora_tag['tag']['Gender'] = r_gender.get(value)
-                universalD_tag['tag']['Gender'] = r_gender.get(value)
-                continue
+class Tag(namedtuple('Tag', ['pos', 'ud_pos', 'base', 'features'])):
+    # immutable and hashable, derived tags share the feature entries of the tag they come from;
+    # features are (name, oc_key, oc_value, ud_key, ud_value) in the order they were set,
+    # a None key leaves the feature out of that form
+    __slots__ = ()
 
-            if name in ['лицо', '4']:
-                opencorpora_tag['tag']['Person'] = r_person_opencorpora.get(value)
-                universalD_tag['tag']['Person'] = r_person_universalD.get(value)
-                continue
+    def with_pos(self, pos=None, ud_pos=None):
+        return self._replace(pos=pos or self.pos, ud_pos=ud_pos or self.ud_pos)
 
-            if name in ['число', '5'] and value is not None:
-                opencorpora_tag['tag']['Number'] = r_number[value]
-                universalD_tag['tag']['Number'] = r_number[value]
-                continue
+    def with_base(self, base):
+        return self._replace(base=base)
 
-            if name in ['накл', '6'] and value is not None:
-                continue
+    def with_feature(self, name, oc_value=missing, ud_value=missing, oc_key=None, ud_key=None):
+        entry = (name, None if oc_value is missing else oc_key or name, None if oc_value is missing else oc_value,
+                 None if ud_value is missing else ud_key or name, None if ud_value is missing else ud_value)
+        for i, f in enumerate(self.features):
+            if f[0] == name:
+                return self._replace(features=self.features[:i] + (entry,) + self.features[i + 1:])
+        return self._replace(features=self.features + (entry,))
 
-            if name == 'деепр':
-                continue
+    def without(self, name):
+        return self._replace(features=tuple(f for f in self.features if f[0] != name))
 
-            if name == 'прич':
-                continue
+    def _form(self, pos, key_index):
+        tag = {}
+        for f in self.features:
+            if f[key_index] is not None:
+                tag[f[key_index]] = list(f[key_index + 1]) if isinstance(f[key_index + 1], tuple) else f[key_index + 1]
+        form = {'tag': tag, 'pos': pos}
+        if self.base is not None: form['base'] = self.base
+        return form
 
-            if name == 'кр':
-                continue
+    def opencorpora(self):
+        return self._form(self.pos, 1)
 
-            if name in ['помета', '7'] and value is not None:
-                continue
+    def universal(self):
+        return self._form(self.ud_pos, 3)
 
-            if name == 'форма':
-                continue
+    def ud_strings(self):
+        # 'base POS Key=Value|...', one string per value of multi-valued features
+        keys = [(f[3], f[4]) for f in self.features if f[3] is not None]
+        prefix = self.base + ' ' + self.ud_pos
+        if len(keys) == 0: return [prefix]
+        if not any(isinstance(v, tuple) for k, v in keys):
+            return [prefix + ' ' + '|'.join([k + '=' + v for k, v in keys])]
 
-            if name == 'слоги':
-                continue
+        values = [v if isinstance(v, tuple) else (v,) for k, v in keys]
+        return [prefix + ' ' + '|'.join(k + '=' + v for (k, _), v in zip(keys, combination))
+                for combination in product(*values)]
 
-        return [[word_acc, opencorpora_tag, universalD_tag]]
 
-    if template_name == 'conj ru':
-        opencorpora_tag['pos'] = 'CONJ'
-        universalD_tag['pos'] = 'CONJ'
+def parse_template(word_acc, template):
+    template_name = template.name.strip()
+    handler = find_handler(template_name)
+    if handler is None:
+        print(template_name)
+        raise Exception()
 
-        base = get_word_from_slogi(template)[0].replace('́', '')
-        opencorpora_tag['base'] = base
-        universalD_tag['base'] = base
+    return handler(word_acc, template)
 
-        return [[opencorpora_tag, universalD_tag]]
 
-    if 'прил ru' in template_name:
-        opencorpora_tag['pos'] = 'ADJF'
-        universalD_tag['pos'] = 'ADJ'
+@template_handler('Форма-сущ')
+def parse_noun_form(word_acc, template):
+    tag = Tag('NOUN', 'NOUN', None, ())
 
-        base = get_word_from_slogi(template)[0].replace('́', '')
-        opencorpora_tag['base'] = base
-        universalD_tag['base'] = base
+    for argument in template.arguments:
+        name, value = get_name_value(argument)
 
-        for argument in template.arguments:
-            name, value = get_name_value(argument)
+        if name in ['база', '1'] and value is not None:
+            tag = tag.with_base(value)
+            continue
 
-            if name == 'тип':
-                if value is None: continue
-                if value == 'качественное':
-                    if 'flags' in opencorpora_tag['tag']:
-                        opencorpora_tag['tag']['flags'] += ',' + r_degree_opencorpora.get(value)
-                    else:
-                        opencorpora_tag['tag']['more'] = r_degree_opencorpora.get(value)
-                    universalD_tag['tag']['Degree'] = r_degree_univarsalD.get(value)
-                    continue
-                raise Exception
-
-            if name == 'степень':
-                if value is None: continue
-                raise Exception
-
-        # склонения по падежу / числу
-        parsed = wtp.parse(get_wikitext_api_expandtemplates(template.string))
-        table = table_to_2d(BeautifulSoup(parsed.string.replace('<br>','\n'), 'lxml').table)
-
-        _header = table.pop(0)
-        assert _header[0].strip() == '[[падеж]]'
-        assert _header[1].strip() == '[[падеж]]'
-        assert _header[2].strip() == '[[единственное число|ед. ч.]]'
-        assert _header[3].strip() == '[[единственное число|ед. ч.]]'
-        assert _header[4].strip() == '[[единственное число|ед. ч.]]'
-        assert _header[5].strip() == '[[множественное число|мн. ч.]]'
-        _header = table.pop(0)
-        assert _header[0].strip() == '[[падеж]]'
-        assert _header[1].strip() == '[[падеж]]'
-        assert 'мужской' in _header[2]
-        assert 'средний' in _header[3]
-        assert 'женский' in _header[4]
-        assert _header[5].strip() == '[[множественное число|мн. ч.]]'
-
-        for row in table:
-            case = re.search(r'\[\[([а-яё. ]+)(\||\]\])', row[0]).group(1)
-            assert case in r_case_opencorpora or 'краткая' in case
-            anim = re.search(r'\[\[([а-яё. ]+)(\||\]\])', row[1]).group(1)
-            assert anim in r_anim or anim in r_case_opencorpora or 'краткая' in case
-
-            for i in range(4):
-                words = None
-                m = re.fullmatch(r'([́а-яёА-ЯЁ]+)', row[2+i])
-                if m is None: m = re.search(r'>([́а-яёА-ЯЁ]+)<', row[2+i])
-
-                if m is not None:
-                    words = [m.group(1)]
-                else:
-                    if '—' in row[2+i]:
-                        words = None
-                    else:
-                        splits = re.split(split_regex, row[2+i])
-                        if len(splits) > 1:
-                            words = splits
-                        else:
-                            raise Exception
-
-
-                if words is not None:
-                    opencorpora_tag_copy = copy.deepcopy(opencorpora_tag)
-                    universalD_tag_copy = copy.deepcopy(universalD_tag)
-
-                    if 'краткая' not in case:
-                        opencorpora_tag_copy['tag']['Case'] = r_case_opencorpora[case]
-                        universalD_tag_copy['tag']['Case'] = r_case_universalD[case]
-                    else:
-                        opencorpora_tag_copy['pos'] = 'ADJS'
-                        universalD_tag_copy['tag']['Variant'] = 'Short'
-                    opencorpora_tag_copy['tag']['Number'] = r_number['ед'] if i < 3 else r_number['мн']
-                    universalD_tag_copy['tag']['Number'] = r_number['ед'] if i < 3 else r_number['мн']
-                    if i < 3:
-                        genders = {0: 'м', 1: 'с', 2: 'ж'}
-                        opencorpora_tag_copy['tag']['Gender'] = r_gender[genders[i]]
-                        universalD_tag_copy['tag']['Gender'] = r_gender[genders[i]]
-
-                    if anim in r_anim:
-                        opencorpora_tag_copy['tag']['Animacy'] = r_anim[anim]
-                        universalD_tag_copy['tag']['Animacy'] = r_anim[anim]
-
-                    variants.append([words, opencorpora_tag_copy, universalD_tag_copy])
-
-        return variants
-
-    if template_name == 'сущ-ru':
-        opencorpora_tag['pos'] = 'NOUN'
-        universalD_tag['pos'] = 'NOUN'
-
-        for argument in template.arguments:
-            name, value = get_name_value(argument)
-
-            if name in ['слово', '1'] and value is not None:
-                opencorpora_tag['base'] = value.replace('́', '')
-                universalD_tag['base'] = value.replace('́', '')
+        if name in ['падеж', '2'] and value is not None:
+            if value in ['ив', 'рв', 'рдп']:
+                tag = tag.with_feature('Case', tuple(r_case_opencorpora.get(v) for v in value),
+                                       tuple(r_case_universalD.get(v) for v in value))
                 continue
 
-            if name in ['индекс', '2'] and value is not None:
-                data = value.split()[:-1]
-
-                for d in data:
-                    if d in r_gender:
-                        opencorpora_tag['tag']['Gender'] = r_gender.get(d)
-                        universalD_tag['tag']['Gender'] = r_gender.get(d)
-                        continue
-
-                    if d in r_anim:
-                        opencorpora_tag['tag']['Animacy'] = r_anim.get(d)
-                        universalD_tag['tag']['Animacy'] = r_anim.get(d)
-                        continue
+            if ' и ' in value:
+                tag = tag.with_feature('Case', tuple(r_case_opencorpora.get(v) for v in value.split(' и ')),
+                                       tuple(r_case_universalD.get(v) for v in value.split(' и ')))
                 continue
 
-        # склонения по падежу / числу
-        parsed = wtp.parse(get_wikitext_api_expandtemplates(template.string))
-        table = parsed.tables[0].data()
-
-        _header = table.pop(0)
-        assert 'падеж' in _header[0]
-        assert 'единственное' in _header[1]
-        assert 'множественное' in _header[2]
-
-        for row in table:
-            case = re.search(r'\[\[([а-яё. ]+)(\||\]\])', row[0]).group(1)
-            assert case in r_case_opencorpora
-
-            for i in range(2):
-                m = re.fullmatch(r'([́а-яёА-ЯЁ]+)', row[1+i])
-                if m is None: m = re.search(r'>([́а-яёА-ЯЁ]+)<', row[1+i])
+            tag = tag.with_feature('Case', r_case_opencorpora.get(value), r_case_universalD.get(value))
+            continue
 
-                if m is not None:
-                    words = [m.group(1)]
-                else:
-                    if '—' in row[1+i]:
-                        words = None
-                    else:
-                        splits = re.split(split_regex, row[1+i])
-                        if len(splits) > 1:
-                            words = splits
-                        else:
-                            raise Exception
+        if name in ['число', '3'] and value is not None:
+            tag = tag.with_feature('Number', r_number[value], r_number[value])
+            continue
 
+        if name in ['помета', '5']:
+            continue
 
-                if words is not None:
-                    opencorpora_tag_copy = copy.deepcopy(opencorpora_tag)
-                    universalD_tag_copy = copy.deepcopy(universalD_tag)
+        if name == 'слоги':
+            continue
 
-                    opencorpora_tag_copy['tag']['Case'] = r_case_opencorpora[case]
-                    universalD_tag_copy['tag']['Case'] = r_case_universalD[case]
+    return [[word_acc, tag]]
 
-                    opencorpora_tag_copy['tag']['Number'] = r_number['ед'] if i == 0 else r_number['мн']
-                    universalD_tag_copy['tag']['Number'] = r_number['ед'] if i == 0 else r_number['мн']
 
-                    variants.append([words, opencorpora_tag_copy, universalD_tag_copy])
+@template_handler('Форма-гл')
+def parse_verb_form(word_acc, template):
+    tag = Tag('VERB', 'VERB', None, ())
 
-        return variants
+    for argument in template.arguments:
+        name, value = get_name_value(argument)
 
-    if 'сущ ru' in template_name:
-        opencorpora_tag['pos'] = 'NOUN'
-        universalD_tag['pos'] = 'NOUN'
-
-        base = get_word_from_slogi(template)[0].replace('́', '')
-        opencorpora_tag['base'] = base
-        universalD_tag['base'] = base
-
-        data = template_name.split()[2:-1]
-
-        for d in data:
-            if d in r_gender:
-                opencorpora_tag['tag']['Gender'] = r_gender.get(d)
-                universalD_tag['tag']['Gender'] = r_gender.get(d)
-                continue
+        if name in ['база', '1'] and value is not None:
+            tag = tag.with_base(value)
+            continue
 
-            if d in r_anim:
-                opencorpora_tag['tag']['Animacy'] = r_anim.get(d)
-                universalD_tag['tag']['Animacy'] = r_anim.get(d)
-                continue
+        if name in ['время', '2']:
+            if value is None: continue
+            tag = tag.with_feature('Tense', r_tense_opencorpora.get(value), r_tense_universalD.get(value))
+            continue
 
-            print(template_name, d)
+        if name == 'залог':
+            continue
 
-        # склонения по падежу / числу
-        parsed = wtp.parse(get_wikitext_api_expandtemplates(template.string))
-        table = parsed.tables[0].data()
-        _header = table.pop(0)
-        assert 'падеж' in _header[0]
-        assert 'единственное' in _header[1]
-        assert 'множественное' in _header[2]
+        if name in ['род', '3']:
+            if value is None: continue
+            tag = tag.with_feature('Gender', r_gender.get(value), r_gender.get(value))
+            continue
 
-        for row in table:
-            case = re.match(r'\[\[([а-яё.]+)(\||\]\])', row[0]).group(1)
-            assert case in r_case_opencorpora
+        if name in ['лицо', '4']:
+            tag = tag.with_feature('Person', r_person_opencorpora.get(value), r_person_universalD.get(value))
+            continue
 
-            for i in range(2):
-                m = re.fullmatch(r'([́а-яёА-ЯЁ]+)', row[1+i])
-                if m is None: m = re.search(r'>([́а-яёА-ЯЁ]+)<', row[1+i])
+        if name in ['число', '5'] and value is not None:
+            tag = tag.with_feature('Number', r_number[value], r_number[value])
+            continue
 
-                if m is not None:
-                    words = [m.group(1)]
-                else:
-                    if '—' in row[1+i]:
-                        words = None
-                    else:
-                        splits = re.split(split_regex, row[1+i])
-                        if len(splits) > 1:
-                            words = splits
-                        else:
-                            raise Exception
+        if name in ['накл', '6', 'деепр', 'прич', 'кр', 'форма', 'слоги']:
+            continue
 
+        if name in ['помета', '7'] and value is not None:
+            continue
 
-                if words is not None:
-                    opencorpora_tag_copy = copy.deepcopy(opencorpora_tag)
-                    universalD_tag_copy = copy.deepcopy(universalD_tag)
+    return [[word_acc, tag]]
 
-                    opencorpora_tag_copy['tag']['Case'] = r_case_opencorpora[case]
-                    universalD_tag_copy['tag']['Case'] = r_case_universalD[case]
 
-                    opencorpora_tag_copy['tag']['Number'] = r_number['ед'] if i == 0 else r_number['мн']
-                    universalD_tag_copy['tag']['Number'] = r_number['ед'] if i == 0 else r_number['мн']
+@template_handler('conj ru')
+def parse_conjunction(word_acc, template):
+    from wiktparser import get_word_from_slogi
 
-                    variants.append([words, opencorpora_tag_copy, universalD_tag_copy])
+    base = get_word_from_slogi(template)[0].replace('́', '')
+    return [[[], Tag('CONJ', 'CONJ', base, ())]]
 
-        return variants
 
-    if 'Фам ru' in template_name:
-        # Фамилии, скип
-        return []
+adjective_label_regex = re.compile(r'\[\[([а-яё. ]+)(\||\]\])')
 
-    if 'гл ru' in template_name:
-        opencorpora_tag['pos'] = 'INFN'
-        universalD_tag['pos'] = 'VERB'
-        universalD_tag['tag']['VerbForm'] = 'Inf'
+@template_handler('прил ru', family=True)
+def parse_adjective(word_acc, template):
+    from wiktparser import get_word_from_slogi, expand_template
 
-        base = get_word_from_slogi(template)[0].replace('́', '')
-        opencorpora_tag['base'] = base
-        universalD_tag['base'] = base
+    variants = []
+    base = get_word_from_slogi(template)[0].replace('́', '')
+    tag = Tag('ADJF', 'ADJ', base, ())
 
-        for argument in template.arguments:
-            name, value = get_name_value(argument)
+    for argument in template.arguments:
+        name, value = get_name_value(argument)
 
-            if name == 'НП':
-                opencorpora_tag['tag']['TRns'] = 'intr' if value == '1' else 'tran'
+        if name == 'тип':
+            if value is None: continue
+            if value == 'качественное':
+                tag = tag.with_feature('Degree', r_degree_opencorpora.get(value), r_degree_univarsalD.get(value),
+                                       oc_key='more')
                 continue
+            raise Exception
+
+        if name == 'степень':
+            if value is None: continue
+            raise Exception
+
+    # склонения по падежу / числу
+    table = table_to_2d(html_table(expand_template(template)))
+
+    _header = table.pop(0)
+    assert _header[0].strip() == '[[падеж]]'
+    assert _header[1].strip() == '[[падеж]]'
+    assert _header[2].strip() == '[[единственное число|ед. ч.]]'
+    assert _header[3].strip() == '[[единственное число|ед. ч.]]'
+    assert _header[4].strip() == '[[единственное число|ед. ч.]]'
+    assert _header[5].strip() == '[[множественное число|мн. ч.]]'
+    _header = table.pop(0)
+    assert _header[0].strip() == '[[падеж]]'
+    assert _header[1].strip() == '[[падеж]]'
+    assert 'мужской' in _header[2]
+    assert 'средний' in _header[3]
+    assert 'женский' in _header[4]
+    assert _header[5].strip() == '[[множественное число|мн. ч.]]'
+
+    genders = {0: 'м', 1: 'с', 2: 'ж'}
+    for row in table:
+        case = adjective_label_regex.search(row[0]).group(1)
+        assert case in r_case_opencorpora or 'краткая' in case
+        anim = adjective_label_regex.search(row[1]).group(1)
+        assert anim in r_anim or anim in r_case_opencorpora or 'краткая' in case
+
+        if 'краткая' not in case:
+            row_tag = tag.with_feature('Case', r_case_opencorpora[case], r_case_universalD[case])
+        else:
+            row_tag = tag.with_pos('ADJS').with_feature('Variant', ud_value='Short')
+
+        for i in range(4):
+            words = cell_words(row[2+i])
+
+            if words is not None:
+                cell_tag = row_tag.with_feature('Number', r_number['ед'] if i < 3 else r_number['мн'],
+                                                r_number['ед'] if i < 3 else r_number['мн'])
+                if i < 3:
+                    cell_tag = cell_tag.with_feature('Gender', r_gender[genders[i]], r_gender[genders[i]])
+
+                if anim in r_anim:
+                    cell_tag = cell_tag.with_feature('Animacy', r_anim[anim], r_anim[anim])
+
+                variants.append([words, cell_tag])
+
+    return variants
+
+
+def noun_table_variants(tag, table, match_case):
+    variants = []
+    for row in table:
+        case = match_case(row[0]).group(1)
+        assert case in r_case_opencorpora
+        row_tag = tag.with_feature('Case', r_case_opencorpora[case], r_case_universalD[case])
 
-            if name == 'соотв':
-                if value is None:
-                    opencorpora_tag['tag']['ASpc'] = 'perf'
-                    universalD_tag['tag']['Aspect'] = 'Perf'
-                else:
-                    opencorpora_tag['tag']['ASpc'] = 'impf'
-                    universalD_tag['tag']['Aspect'] = 'Imp'
-                continue
+        for i in range(2):
+            words = cell_words(row[1+i])
 
-        variants.append([word_acc, copy.deepcopy(opencorpora_tag), copy.deepcopy(universalD_tag)])
-        opencorpora_tag['pos'] = 'VERB'
-        universalD_tag['tag'].pop('VerbForm')
+            if words is not None:
+                variants.append([words, row_tag.with_feature('Number', r_number['ед'] if i == 0 else r_number['мн'],
+                                                             r_number['ед'] if i == 0 else r_number['мн'])])
+    return variants
 
-        # склонения по падежу / числу
-        parsed = wtp.parse(get_wikitext_api_expandtemplates(template.string))
-        table = parsed.tables[0].data()
-        _header = table.pop(0)
-        assert 'настоящее' in _header[1]
-        assert 'прошедшее' in _header[2]
-        assert 'повелительное' in _header[3]
 
-        for row in table:
-            person = re.match(r'\[\[([а-яё.]+)(\||\]\])', row[0]).group(1)
-            assert person in r_person_opencorpora
+noun_index_label_regex = re.compile(r'\[\[([а-яё. ]+)(\||\]\])')
 
-            for i in range(3):
-                m = re.fullmatch(r'([́а-яёА-ЯЁ]+)', row[1+i])
-                if m is None: m = re.search(r'>([́а-яёА-ЯЁ]+)<', row[1+i])
+@template_handler('сущ-ru')
+def parse_noun_index(word_acc, template):
+    from wiktparser import expand_template
 
-                if m is not None:
-                    words = [m.group(1)]
-                else:
-                    if '—' in row[1+i]:
-                        words = None
-                    else:
-                        splits = re.split(split_regex, row[1+i])
-                        if len(splits) > 1:
-                            words = splits
-                        else:
-                            raise Exception
+    tag = Tag('NOUN', 'NOUN', None, ())
 
+    for argument in template.arguments:
+        name, value = get_name_value(argument)
 
-                if words is not None:
-                    opencorpora_tag_copy = copy.deepcopy(opencorpora_tag)
-                    universalD_tag_copy = copy.deepcopy(universalD_tag)
+        if name in ['слово', '1'] and value is not None:
+            tag = tag.with_base(value.replace('́', ''))
+            continue
 
-                    opencorpora_tag_copy['tag']['Person'] = r_person_opencorpora[person]
-                    universalD_tag_copy['tag']['Person'] = r_person_universalD[person]
+        if name in ['индекс', '2'] and value is not None:
+            for d in value.split()[:-1]:
+                if d in r_gender:
+                    tag = tag.with_feature('Gender', r_gender.get(d), r_gender.get(d))
+                    continue
 
-                    opencorpora_tag_copy['tag']['Number'] = r_number['ед'] if i == 0 else r_number['мн']
-                    universalD_tag_copy['tag']['Number'] = r_number['ед'] if i == 0 else r_number['мн']
+                if d in r_anim:
+                    tag = tag.with_feature('Animacy', r_anim.get(d), r_anim.get(d))
+                    continue
+            continue
 
-                    variants.append([words, opencorpora_tag_copy, universalD_tag_copy])
+    # склонения по падежу / числу
+    parsed = wtp.parse(expand_template(template))
+    table = parsed.tables[0].data()
 
-        table = table_to_2d(BeautifulSoup('<table>' + parsed.string.replace('<br>', '\n') + '</table>', 'lxml').table)
+    _header = table.pop(0)
+    assert 'падеж' in _header[0]
+    assert 'единственное' in _header[1]
+    assert 'множественное' in _header[2]
 
-        for row in table:
-            if 'причастие' in row[0]:
-                tense = 'наст' if 'настоящего' in row[0] else 'пр'
+    return noun_table_variants(tag, table, noun_index_label_regex.search)
 
-                opencorpora_tag_copy = copy.deepcopy(opencorpora_tag)
-                universalD_tag_copy = copy.deepcopy(universalD_tag)
 
-                opencorpora_tag_copy['pos'] = 'PRTF'
+noun_label_regex = re.compile(r'\[\[([а-яё.]+)(\||\]\])')
 
-                opencorpora_tag_copy['tag']['Tense'] = r_tense_opencorpora[tense]
-                universalD_tag_copy['tag']['Tense'] = r_tense_universalD[tense]
+@template_handler('сущ ru', family=True)
+def parse_noun(word_acc, template):
+    from wiktparser import get_word_from_slogi, expand_template
 
-            if 'деепричастие' in row[0]:
-                tense = 'наст' if 'настоящего' in row[0] else 'пр'
+    template_name = template.name.strip()
+    base = get_word_from_slogi(template)[0].replace('́', '')
+    tag = Tag('NOUN', 'NOUN', base, ())
 
-                opencorpora_tag_copy = copy.deepcopy(opencorpora_tag)
-                universalD_tag_copy = copy.deepcopy(universalD_tag)
+    for d in template_name.split()[2:-1]:
+        if d in r_gender:
+            tag = tag.with_feature('Gender', r_gender.get(d), r_gender.get(d))
+            continue
 
-                opencorpora_tag_copy['pos'] = 'GRND'
-                universalD_tag_copy['tag']['VerbForm'] = 'Conv'
+        if d in r_anim:
+            tag = tag.with_feature('Animacy', r_anim.get(d), r_anim.get(d))
+            continue
 
-                opencorpora_tag_copy['tag']['Tense'] = r_tense_opencorpora[tense]
-                universalD_tag_copy['tag']['Tense'] = r_tense_universalD[tense]
+        print(template_name, d)
 
-            if 'будущее' in row[0]:
-                tense = 'буд'
+    # склонения по падежу / числу
+    parsed = wtp.parse(expand_template(template))
+    table = parsed.tables[0].data()
+    _header = table.pop(0)
+    assert 'падеж' in _header[0]
+    assert 'единственное' in _header[1]
+    assert 'множественное' in _header[2]
 
-                opencorpora_tag_copy = copy.deepcopy(opencorpora_tag)
-                universalD_tag_copy = copy.deepcopy(universalD_tag)
+    return noun_table_variants(tag, table, noun_label_regex.match)
 
-                opencorpora_tag_copy['tag']['Tense'] = r_tense_opencorpora[tense]
-                universalD_tag_copy['tag']['Tense'] = r_tense_universalD[tense]
 
-                row[1] = row[1].replace('буду/будешь…', '').strip()
+@template_handler('Фам ru', family=True)
+def parse_surname(word_acc, template):
+    # Фамилии, скип
+    return []
 
-            words = []
-            for w in re.split(split_regex, row[1]):
-                m = re.search(r'\|([́а-яёА-ЯЁ]+)\]\]', w)
-                if m is None: m = re.fullmatch(r'([́а-яёА-ЯЁ]+)', w)
-                words.append(m.group(1))
 
-            variants.append([words, opencorpora_tag_copy, universalD_tag_copy])
+person_label_regex = re.compile(r'\[\[([а-яё.]+)(\||\]\])')
+linked_word_regex = re.compile(r'\|([́а-яёА-ЯЁ]+)\]\]')
 
-        return variants
+@template_handler('гл ru', family=True)
+def parse_verb(word_acc, template):
+    from wiktparser import get_word_from_slogi, expand_template
 
-    print(template_name)
-    raise Exception()
\ No newline at end of file
+    variants = []
+    base = get_word_from_slogi(template)[0].replace('́', '')
+    tag = Tag('INFN', 'VERB', base, ()).with_feature('VerbForm', ud_value='Inf')
+
+    for argument in template.arguments:
+        name, value = get_name_value(argument)
+
+        if name == 'НП':
+            tag = tag.with_feature('TRns', 'intr' if value == '1' else 'tran')
+            continue
+
+        if name == 'соотв':
+            if value is None:
+                tag = tag.with_feature('Aspect', 'perf', 'Perf', oc_key='ASpc')
+            else:
+                tag = tag.with_feature('Aspect', 'impf', 'Imp', oc_key='ASpc')
+            continue
+
+    variants.append([word_acc, tag])
+    tag = tag.with_pos('VERB').without('VerbForm')
+
+    # склонения по падежу / числу
+    parsed = wtp.parse(expand_template(template))
+    table = parsed.tables[0].data()
+    _header = table.pop(0)
+    assert 'настоящее' in _header[1]
+    assert 'прошедшее' in _header[2]
+    assert 'повелительное' in _header[3]
+
+    for row in table:
+        person = person_label_regex.match(row[0]).group(1)
+        assert person in r_person_opencorpora
+        row_tag = tag.with_feature('Person', r_person_opencorpora[person], r_person_universalD[person])
+
+        for i in range(3):
+            words = cell_words(row[1+i])
+
+            if words is not None:
+                cell_tag = row_tag.with_feature('Number', r_number['ед'] if i == 0 else r_number['мн'],
+                                                r_number['ед'] if i == 0 else r_number['мн'])
+                variants.append([words, cell_tag])
+
+    table = table_to_2d(html_table('<table>' + parsed.string + '</table>'))
+
+    for row in table:
+        if 'причастие' in row[0]:
+            tense = 'наст' if 'настоящего' in row[0] else 'пр'
+            cell_tag = tag.with_pos('PRTF').with_feature('Tense', r_tense_opencorpora[tense], r_tense_universalD[tense])
+
+        if 'деепричастие' in row[0]:
+            tense = 'наст' if 'настоящего' in row[0] else 'пр'
+            cell_tag = tag.with_pos('GRND').with_feature('VerbForm', ud_value='Conv') \
+                .with_feature('Tense', r_tense_opencorpora[tense], r_tense_universalD[tense])
+
+        if 'будущее' in row[0]:
+            tense = 'буд'
+            cell_tag = tag.with_feature('Tense', r_tense_opencorpora[tense], r_tense_universalD[tense])
+
+            row[1] = row[1].replace('буду/будешь…', '').strip()
+
+        words = []
+        for w in split_pattern.split(row[1]):
+            m = linked_word_regex.search(w)
+            if m is None: m = word_regex.fullmatch(w)
+            words.append(m.group(1))
+
+        variants.append([words, cell_tag])
+
+    return variants
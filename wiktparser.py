@@ -1,10 +1,18 @@
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
 import re
+import time
 from pprint import pprint
-import wiktextract
 from lxml import etree
-from requests import get
+import requests
 import wikitextparser as wtp
 
+import wikt_dump
+import wikt_inflection
+from wiki_cache import WikiCache
 from wikt_template_parser import parse_template, known_template
 
 replacements_opencorpora = {'adv ru': 'ADVB',
@@ -75,31 +83,133 @@ r_person_universalD = {
 }
 
 
-def get_wikitext_api(word, language='ru'):
-    resp = get('https://{}.wiktionary.org/w/api.php'.format(language), {
-        'action': 'query',
-        'titles': word,
-        'languages': language,
-        'prop': 'revisions',
-        'rvprop': 'content',
-        'format': 'json',
-    }).json()
+api_url = 'https://{}.wiktionary.org/w/api.php'
+# the query API accepts up to 50 titles per request
+max_titles = 50
+
+# set to None to always go to the network
+wiki_cache = WikiCache()
+# a wikt_dump.MultistreamDump replaces the network and the cache
+wiki_dump = None
+# dict_parser.Parser that add_variants writes to
+parser = None
+# regular noun tables can be generated locally, the rest goes to expandtemplates; off until
+# `wikt_inflection.py check` passes on expansions recorded from the API (wikt_inflection_titles.txt)
+expand_locally = False
+
+session = None
+
+def get_session():
+    global session
+    if session is None:
+        session = requests.Session()
+    return session
+
+def fetch_wikitexts_api(words, language='ru'):
+    result = {}
+
+    for i in range(0, len(words), max_titles):
+        batch = words[i:i + max_titles]
+        params = {
+            'action': 'query',
+            'titles': '|'.join(batch),
+            'redirects': 1,
+            'prop': 'revisions',
+            'rvprop': 'content',
+            'format': 'json',
+        }
+
+        normalized = {}
+        redirects = {}
+        texts = {}
+        cont = {}
+        while True:
+            resp = get_session().get(api_url.format(language), params={**params, **cont}).json()
+            query = resp.get('query', {})
+
+            for n in query.get('normalized', []):
+                normalized[n['from']] = n['to']
+            for r in query.get('redirects', []):
+                redirects[r['from']] = r['to']
+            for page in query.get('pages', {}).values():
+                if 'revisions' in page:
+                    texts[page['title']] = page['revisions'][0]['*']
+                else:
+                    texts.setdefault(page['title'], None)
+
+            # long pages do not fit in one response
+            if 'continue' not in resp: break
+            cont = resp['continue']
+
+        for word in batch:
+            title = normalized.get(word, word)
+            seen = set()
+            while title in redirects and title not in seen:
+                seen.add(title)
+                title = redirects[title]
+            result[word] = texts.get(title)
+
+    return result
+
+def get_redirect(data):
+    if 'redirect' in data.lower():
+        m = re.search('\[\[([́а-яёА-ЯЁ]+)\]\]', data)
+        if m is not None:
+            return m.group(1)
+    return None
 
-    pages = resp['query']['pages']
-    page = list(pages.values())[0]
-    if 'revisions' in page:
-        data = page['revisions'][0]['*']
-    else:
-        data = ''
+def get_wikitexts_api(words, language='ru'):
+    texts = {}
+    missing = []
+    for title in words:
+        found = False
+        if wiki_cache is not None:
+            found, texts[title] = wiki_cache.get(title, language)
+        if not found:
+            if wiki_cache is not None and wiki_cache.offline:
+                texts[title] = None
+            else:
+                missing.append(title)
+
+    if len(missing) > 0:
+        fetched = fetch_wikitexts_api(missing, language)
+        texts.update(fetched)
+        if wiki_cache is not None:
+            wiki_cache.put_many(fetched, language)
+
+    return texts
+
+def get_wikitexts(words, language='ru'):
+    titles = {w: w for w in words}
+    seen = {w: set() for w in titles}
+    result = {}
+
+    while len(titles) > 0:
+        if wiki_dump is not None:
+            texts = {title: wiki_dump.get_wikitext(title) for title in set(titles.values())}
+        else:
+            texts = get_wikitexts_api(list(set(titles.values())), language)
+
+        # pages that only say where the word is described
+        next_titles = {}
+        for word, title in titles.items():
+            data = texts[title]
+            seen[word].add(title)
+
+            redirect = get_redirect(data) if data is not None else None
+            if redirect is None or redirect in seen[word]:
+                result[word] = data or ''
+            else:
+                next_titles[word] = redirect
+        titles = next_titles
 
-    if 'redirect' in data.lower():
-        new_word = re.search('\[\[([́а-яёА-ЯЁ]+)\]\]', data).group(1)
-        return get_wikitext_api(new_word, language)
+    return result
 
-    return data
+def get_wikitext(word, language='ru'):
+    return get_wikitexts([word], language)[word]
 
 def get_wikitext_api_expandtemplates(text, language='ru'):
-    resp = get('https://{}.wiktionary.org/w/api.php'.format(language), {
+    resp = get_session().get(api_url.format(language), params={
         'action': 'expandtemplates',
         'text': text,
         'prop': 'wikitext',
@@ -109,6 +219,24 @@ def get_wikitext_api_expandtemplates(text, language='ru'):
     data = resp['expandtemplates']['wikitext']
     return data
 
+def template_arguments(template):
+    return {a.name.strip(): a.value.strip() for a in template.arguments if len(a.value.strip()) > 0}
+
+def template_headword(template):
+    headword = None
+    if template.name.strip() == 'сущ-ru':
+        headword = template_arguments(template).get('слово') or template_arguments(template).get('1')
+    if headword is None or not accent(headword):
+        headword = (get_word_from_slogi(template) or [None])[0]
+    return headword
+
+def expand_template(template, language='ru'):
+    if expand_locally and language == 'ru':
+        text = wikt_inflection.expand(template.name.strip(), template_headword(template), template_arguments(template))
+        if text is not None: return text
+
+    return get_wikitext_api_expandtemplates(template.string, language)
+
 def accent(*words):
     return all(['́' in w or 'ё' in w for w in words])
 
@@ -365,7 +493,7 @@ def get_variants_from_section(section):
 
 
 def parse_wikt_ru(word, parsed=None):
-    if parsed is None: parsed = wtp.parse(get_wikitext_api(word))
+    if parsed is None: parsed = wtp.parse(get_wikitext(word))
 
     variants = []
 
@@ -386,40 +514,13 @@ def parse_wikt_en(word):
     pass
 
 
-def dict_to_tag_UD(data):
-    tag = data['base'] + ' ' + data['pos']
-
-    if len(data['tag']) > 0:
-        tag += ' '
-        for key in data['tag']:
-            if isinstance(data['tag'][key], list):
-                pass
-            else:
-                tag += key + '=' + data['tag'][key] + '|'
-
-        tag = tag[:-1]
-
-    if len(data['tag']) > 0:
-        for key in data['tag']:
-            if isinstance(data['tag'][key], list):
-                dicts = []
-                for i in data['tag'][key]:
-                    td = data.copy()
-                    td['tag'][key] = i
-                    dicts.append(td)
-                return dicts
-
-    return tag
-
-def add_variants_dict(word, data, p):
-    m = dict_to_tag_UD(data)
-    if isinstance(m, list):
-        for d in m:
-            add_variants_dict(word, d, p)
-    else:
+def add_variants_tag(word, tag, p):
+    for m in tag.ud_strings():
         parser.add_homograph(word, [p, m])
 
 def add_variants(variants):
+    from dict_parser import count_vovels
+
     for var in variants:
         for form in var[0]:
             p = form.find('́')
@@ -427,11 +528,11 @@ def add_variants(variants):
             if count_vovels(word) < 2: continue
             if p != -1:
                 if word in parser.homographs:
-                    add_variants_dict(word, var[2], p)
+                    add_variants_tag(word, var[1], p)
                     continue
 
                 if word in parser.accents and p != parser.accents[word]:
-                    add_variants_dict(word, var[2], p)
+                    add_variants_tag(word, var[1], p)
                     add_variants(variants)
                     return
 
@@ -439,36 +540,152 @@ def add_variants(variants):
                     parser.add_accent(word, p)
                     continue
 
+def ingest_pages(pages):
+    # worker side: everything up to the variants, nothing touches the dictionary
+    results = []
+    for word, text in pages:
+        try:
+            results.append((word, parse_wikt_ru(word, wtp.parse(text)), None))
+        except Exception as e:
+            results.append((word, None, repr(e)))
+    return results
+
+def ingest_streams(path, start=0):
+    from dict_parser import count_vovels
+
+    for offset, pages in wikt_dump.iter_pages(path, start):
+        yield offset, [(p['title'], p['text']) for p in pages
+                       if p['ns'] == 0 and p['redirect'] is None
+                       and re.fullmatch(r'[а-яёА-ЯЁ]+', p['title']) and count_vovels(p['title']) >= 2]
+
+def read_checkpoint(path):
+    if path is None or not os.path.exists(path): return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def write_checkpoint(path, state):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+def journal_tail(journal_path, size, length=4096):
+    # identifies the journal a checkpoint was written against by the bytes just before the checkpoint,
+    # a compacted or replaced journal does not end the same way at that size
+    if size == 0: return ''
+    with open(journal_path, 'rb') as f:
+        f.seek(max(0, size - length))
+        return hashlib.sha1(f.read(min(size, length))).hexdigest()
+
+def resume_checkpoint(path, journal_path):
+    # called before Parser.load(): journal records written after the checkpoint
+    # belong to streams that will be merged again
+    state = read_checkpoint(path)
+    if state is None: return None
+    # nothing will be merged again, the journal may hold newer words from text_prepare or deferred.py
+    if state['done']: return state
+
+    size = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+    if size < state['journal_size'] or journal_tail(journal_path, state['journal_size']) != state['journal_tail']:
+        raise Exception('journal is not the one the checkpoint was written against, was it compacted? '
+                        'Use --restart', path)
+    if size > state['journal_size']:
+        with open(journal_path, 'rb+') as f:
+            f.truncate(state['journal_size'])
+    return state
+
+def ingest_dump(path, dictionary, workers=None, checkpoint_path=None, checkpoint_every=20, state=None):
+    global parser
+    parser = dictionary
+    workers = os.cpu_count() if workers is None else workers
+
+    state = state or {'offset': 0, 'pages': 0, 'done': False}
+    if state['done']:
+        print('dump already ingested', state['pages'], 'pages')
+        return 0
+    if checkpoint_path is not None and dictionary.journal_path is None:
+        raise Exception('checkpoints need the dictionary journal')
+
+    t = time.time()
+    count = 0
+    merged = 0
+
+    def checkpoint(offset):
+        # the journal holds everything merged so far, the offset is the first stream not merged
+        dictionary.flush_journal()
+        size = os.path.getsize(dictionary.journal_path) if os.path.exists(dictionary.journal_path) else 0
+        write_checkpoint(checkpoint_path, {'dump': path, 'offset': offset, 'pages': state['pages'] + count,
+                                           'journal_size': size,
+                                           'journal_tail': journal_tail(dictionary.journal_path, size),
+                                           'done': offset is None})
+
+    def merge(offset, results):
+        nonlocal count, merged
+        if checkpoint_path is not None and merged > 0 and merged % checkpoint_every == 0:
+            checkpoint(offset)
+
+        for word, variants, error in results:
+            if error is not None:
+                print(word, 'error', error)
+                continue
+            print(word, len(variants))
+            add_variants(variants)
+        count += len(results)
+        merged += 1
+
+    if workers == 0:
+        for offset, pages in ingest_streams(path, state['offset']):
+            merge(offset, ingest_pages(pages))
+    else:
+        # pages are parsed in parallel, but merged in dump order so the dictionary
+        # is the same as after a single-process run
+        with multiprocessing.Pool(workers) as pool:
+            pending = collections.deque()
+
+            def finish():
+                offset, result = pending.popleft()
+                merge(offset, result.get())
+
+            for offset, pages in ingest_streams(path, state['offset']):
+                pending.append((offset, pool.apply_async(ingest_pages, (pages,))))
+                if len(pending) > 2 * workers:
+                    finish()
+
+            while len(pending) > 0:
+                finish()
+
+    if checkpoint_path is not None:
+        checkpoint(None)
+
+    elapsed = time.time() - t
+    print(count, 'pages in', round(elapsed, 1), 's,', round(count / max(elapsed, 1e-9), 1), 'pages/s')
+    return count
+
 if __name__ == "__main__":
-    from dict_parser import Parser, count_vovels
+    import argparse
+    from dict_parser import Parser
+
+    argparser = argparse.ArgumentParser(description='Fill the dictionary from a ruwiktionary dump.')
+    argparser.add_argument('dump', help='ruwiktionary-*-pages-articles-multistream.xml.bz2')
+    argparser.add_argument('-j', '--workers', type=int, help='parser processes, 0 parses in this process')
+    argparser.add_argument('--checkpoint', default=r'ingest.checkpoint', help='resume from here after a crash')
+    argparser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start from the beginning')
+    args = argparser.parse_args()
 
     # pprint(parse_wikt_ru('вдали'))
     parser = Parser()
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    state = resume_checkpoint(args.checkpoint, parser.journal_path)
+    if state is not None and state['dump'] != args.dump:
+        raise Exception('checkpoint is for another dump', state['dump'])
+    if state is not None and not state['done']:
+        print('resuming at offset', state['offset'], 'after', state['pages'], 'pages')
     parser.load()
 
-    skip = True
-    def word_cb(word, data):
-        global skip
-        if word == 'прыгать': skip = False
-        if skip: return
-
-        if re.fullmatch(r'[а-яёА-ЯЁ]+', word):
-            if count_vovels(word) < 2: return
-            parsed = wtp.parse(data)
-            variants = parse_wikt_ru(word, parsed)
-            # acc_word = word[:parser.accents[word]] + '́' + word[parser.accents[word]:]
-            print(word, len(variants))
-            # pprint(variants)
-
-            add_variants(variants)
-
-    ctx = wiktextract.parse_wiktionary(
-        r'C:\Users\Admin\Downloads\ruwiktionary-20191120-pages-articles-multistream.xml', word_cb,
-        capture_cb=None,
-        languages=["Russian", "Translingual"],
-        translations=False,
-        pronunciations=False,
-        redirects=False)
+    ingest_dump(args.dump, parser, args.workers, args.checkpoint, state=state)
+    parser.save()
 
 
     # for word in list(parser.accents):